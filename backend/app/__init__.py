@@ -10,6 +10,14 @@ from dotenv import load_dotenv
 
 load_dotenv()
 from app.config import DevelopmentConfig, ProductionConfig, TestingConfig
+from app.catalog_cache import CatalogCache
+from app.image_storage import init_image_storage
+from app.image_jobs import ImageJobs
+from app.reservations import ReservationSweeper
+from app.webhook_inbox import WebhookWorker
+from app.database import patch_psycopg_for_gevent
+from app.payment_lookup import PaymentLookup
+from app.email_outbox import EmailSender
 
 # Instancias que se inicializan más adelante
 db = SQLAlchemy()
@@ -17,6 +25,12 @@ bcrypt = Bcrypt()
 jwt = JWTManager()
 migrate = Migrate()
 mail = Mail()
+catalog_cache = CatalogCache()
+image_jobs = ImageJobs()
+reservation_sweeper = ReservationSweeper()
+webhook_worker = WebhookWorker()
+payment_lookup = PaymentLookup()
+email_sender = EmailSender()
 
 def create_app():
     """
@@ -43,11 +57,19 @@ def create_app():
 
     # Extensiones
     CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+    patch_psycopg_for_gevent()
     db.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
     migrate.init_app(app, db, compare_type=True)
     mail.init_app(app)
+    catalog_cache.init_app(app)
+    init_image_storage(app)
+    image_jobs.init_app(app)
+    reservation_sweeper.init_app(app)
+    webhook_worker.init_app(app)
+    payment_lookup.init_app(app)
+    email_sender.init_app(app)
     print("MAIL_USER:", app.config.get("MAIL_USERNAME"))
     print("MAIL_PASS_LEN:", len(str(app.config.get("MAIL_PASSWORD") or "")))
     print("MAIL_DEFAULT_SENDER:", app.config.get("MAIL_DEFAULT_SENDER"))
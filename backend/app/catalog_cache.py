@@ -0,0 +1,75 @@
+"""
+Cache en memoria (por proceso) de las respuestas del catálogo público.
+
+- Cada entrada vive como máximo CATALOG_CACHE_TTL segundos.
+- Además, cada entrada guarda la "versión" del catálogo con la que se armó.
+  La versión es el mtime de un archivo compartido (CATALOG_VERSION_FILE) que
+  se toca en cada escritura del admin / cambio de stock, así los 4 workers de
+  gunicorn se enteran de la invalidación sin consultar la BD.
+"""
+import os
+import threading
+import time
+
+
+class CatalogCache:
+    def __init__(self, ttl=60, max_entries=256, version_file=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_file = version_file
+        self._entries = {}        # key -> (version, expires_at, value)
+        self._local_version = 0   # fallback si no hay archivo compartido
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('CATALOG_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('CATALOG_CACHE_MAX_ENTRIES', self.max_entries)
+        self.version_file = app.config.get('CATALOG_VERSION_FILE', self.version_file)
+        if self.version_file:
+            os.makedirs(os.path.dirname(self.version_file), exist_ok=True)
+            # crearlo al arrancar para que todos los workers compartan versión (ETag)
+            if not os.path.exists(self.version_file):
+                open(self.version_file, 'a').close()
+        app.extensions['catalog_cache'] = self
+
+    @property
+    def version(self):
+        """Versión actual del catálogo (string estable entre workers)."""
+        if self.version_file:
+            try:
+                return f"{os.stat(self.version_file).st_mtime_ns:x}"
+            except OSError:
+                pass
+        return f"local-{self._local_version}"
+
+    def get_or_set(self, key, loader):
+        """Devuelve el valor cacheado para `key` o lo calcula con `loader()`."""
+        version = self.version
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version and entry[1] > now:
+                return entry[2]
+
+        # Calculamos fuera del lock (el loader va a la BD)
+        value = loader()
+
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                # descartamos la entrada más vieja (orden de inserción)
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (version, now + self.ttl, value)
+        return value
+
+    def invalidate(self):
+        """Llamar después de cada commit que cambie productos, imágenes, categorías o stock."""
+        with self._lock:
+            self._entries.clear()
+            self._local_version += 1
+        if self.version_file:
+            try:
+                with open(self.version_file, 'a'):
+                    pass
+                os.utime(self.version_file, ns=(time.time_ns(), time.time_ns()))
+            except OSError as e:
+                print(f"⚠️ No se pudo actualizar {self.version_file}: {e}")
@@ -11,6 +11,14 @@ class Config:
 
     # --- Base de datos ---
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///default.db")
+    # Pool por proceso (ver app/database.py): 4 workers * (10 + 5) = 60 conexiones como máximo
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),  # segundos esperando una conexión libre
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    }
 
     # --- Email (siempre desde .env) ---
     MAIL_SERVER = os.getenv("MAIL_SERVER", "smtp.gmail.com")
@@ -22,6 +30,13 @@ class Config:
     # Fallback: si no pasás MAIL_DEFAULT_SENDER, usa el username
     MAIL_DEFAULT_SENDER = os.getenv("MAIL_DEFAULT_SENDER", os.getenv("MAIL_USERNAME"))
     MAIL_ASCII_ATTACHMENTS = False
+    MAIL_TIMEOUT = int(os.getenv("MAIL_TIMEOUT", "20"))  # segundos por operación SMTP
+
+    # Bandeja de salida (app/email_outbox.py). Para probar en local sin mandar nada:
+    #   python -m aiosmtpd -n -l localhost:1025   +   MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=False
+    EMAIL_POLL_SECONDS = int(os.getenv("EMAIL_POLL_SECONDS", "10"))  # 0 = sin sender en segundo plano
+    EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))      # emails por conexión SMTP
+    EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
 
     # --- Otros ---
     MERCADOPAGO_ACCESS_TOKEN = os.getenv("MERCADOPAGO_ACCESS_TOKEN")
@@ -31,6 +46,41 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(BASE_DIR), 'uploads')
     SEND_FILE_MAX_AGE_DEFAULT = 60 * 60 * 24 * 365  # 1 año
 
+    # --- Imágenes: 'local' (archivos por digest) | 'db' (bytes en Postgres) ---
+    IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "local")
+    IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(BASE_DIR, 'instance', 'images'))
+    # Con un proxy delante (nginx X-Accel / Apache X-Sendfile) el archivo sale sin pasar por Python
+    USE_X_SENDFILE = os.getenv("USE_X_SENDFILE", "False").lower() == "true"
+
+    # Pillow fuera del request: 'process' | 'thread' | 'sync'
+    IMAGE_PROCESSING = os.getenv("IMAGE_PROCESSING", "process")
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+    # imágenes 'pending' sin terminar hace más de N minutos (worker reiniciado) se reencolan; 0 = nunca
+    IMAGE_REQUEUE_MINUTES = int(os.getenv("IMAGE_REQUEUE_MINUTES", "10"))
+
+    # --- Cache del catálogo público ---
+    CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "60"))  # segundos
+    CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "256"))
+    # archivo compartido entre workers: su mtime es la versión del catálogo
+    CATALOG_VERSION_FILE = os.path.join(BASE_DIR, 'instance', 'catalog.version')
+
+    # --- Reservas de stock durante el pago en MercadoPago ---
+    STOCK_HOLD_MINUTES = int(os.getenv("STOCK_HOLD_MINUTES", "15"))
+    RESERVATION_SWEEP_SECONDS = int(os.getenv("RESERVATION_SWEEP_SECONDS", "60"))  # 0 = sin sweeper
+
+    # --- Webhooks de MercadoPago: bandeja + pool de workers por proceso ---
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))  # 0 = sin workers en segundo plano
+    WEBHOOK_POLL_SECONDS = int(os.getenv("WEBHOOK_POLL_SECONDS", "5"))
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+
+    # Cliente HTTP de MP (app/mp_client.py)
+    MP_CONNECT_TIMEOUT = float(os.getenv("MP_CONNECT_TIMEOUT", "3.05"))
+    MP_READ_TIMEOUT = float(os.getenv("MP_READ_TIMEOUT", "15"))
+    MP_MAX_RETRIES = int(os.getenv("MP_MAX_RETRIES", "3"))
+
+    # Consultas de pagos a MP: cache corto (solo estados finales) + single-flight por payment_id
+    MP_PAYMENT_CACHE_TTL = int(os.getenv("MP_PAYMENT_CACHE_TTL", "30"))
+
 class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = False
@@ -39,8 +89,14 @@ class TestingConfig(Config):
     TESTING = True
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    SQLALCHEMY_ENGINE_OPTIONS = {}
     JWT_SECRET_KEY = "testing-secret"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    IMAGE_PROCESSING = "sync"
+    IMAGE_REQUEUE_MINUTES = 0
+    RESERVATION_SWEEP_SECONDS = 0
+    WEBHOOK_WORKERS = 0
+    EMAIL_POLL_SECONDS = 0
 
 class ProductionConfig(Config):
     DEBUG = False
@@ -1,3 +1,40 @@
-from flask_sqlalchemy import SQLAlchemy
+"""
+Conexiones a Postgres: toda la app usa el mismo engine (app.db) y su pool.
 
-db = SQLAlchemy()
\ No newline at end of file
+- Tamaño del pool por proceso: SQLALCHEMY_ENGINE_OPTIONS en config.py
+  (DB_POOL_SIZE + DB_MAX_OVERFLOW). Con 4 workers de gunicorn el máximo es
+  4 * (pool_size + max_overflow) conexiones: tiene que quedar debajo del
+  max_connections de Postgres (100 por defecto).
+- Con workers gevent, psycopg2 bloquea todo el proceso mientras espera a la BD;
+  patch_psycopg_for_gevent hace que espere cediendo al event loop (lo mismo
+  que psycogreen), así las conexiones del pool se usan en paralelo.
+"""
+
+
+def _gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import OperationalError, extensions
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def patch_psycopg_for_gevent():
+    """Solo si gevent ya parcheó los sockets (worker gevent de gunicorn)."""
+    try:
+        from gevent import monkey
+        from psycopg2 import extensions
+    except ImportError:
+        return False
+    if not monkey.is_module_patched('socket'):
+        return False
+    extensions.set_wait_callback(_gevent_wait_callback)
+    return True
@@ -0,0 +1,265 @@
+"""
+Bandeja de salida de emails.
+
+Registro, recuperación de contraseña y confirmación de compra solo insertan una
+fila (queue_email), en la misma transacción que el cambio que la origina si se
+pasa commit=False; ningún request espera el handshake SMTP.
+
+Un hilo por worker de gunicorn (greenlet con gevent) vacía la bandeja:
+- una sola conexión SMTP (STARTTLS/SSL + login) para todos los emails listos,
+  en lotes de EMAIL_BATCH_SIZE; si el servidor corta, reconecta y sigue
+- cada lote se toma con FOR UPDATE SKIP LOCKED y queda 'sending' con un lease
+  (next_attempt_at): si el proceso muere, otro worker lo retoma al vencer
+- errores 4xx / de conexión: reintento con backoff exponencial hasta
+  EMAIL_MAX_ATTEMPTS -> 'failed'; los 5xx (rechazo permanente) van a 'failed' ya
+
+El login solo se hace si hay MAIL_USERNAME y MAIL_PASSWORD, así se puede probar
+contra un servidor SMTP local de depuración (ver config.py).
+"""
+import smtplib
+import threading
+import traceback
+from datetime import timedelta
+
+LEASE_SECONDS = 300
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+
+NOTIFY_KEY = 'email_outbox_notify'
+
+
+def queue_email(to_email, subject, html, commit=True):
+    """
+    Encola un email. Con commit=False la fila viaja en la transacción del llamador
+    y el sender se despierta recién cuando esa transacción hace commit.
+    """
+    from app import db, email_sender
+    from app.models import EmailOutbox
+
+    db.session.add(EmailOutbox(to_email=to_email, subject=subject, html=html))
+    if commit:
+        db.session.commit()
+        email_sender.notify()
+    else:
+        # lo levanta _after_commit (o lo descarta _after_soft_rollback)
+        db.session.info[NOTIFY_KEY] = True
+
+
+def _after_commit(session):
+    if session.info.pop(NOTIFY_KEY, False):
+        from app import email_sender
+        email_sender.notify()
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # rollback de la transacción de afuera (no de un savepoint): el email no se guardó
+    if previous_transaction.parent is None:
+        session.info.pop(NOTIFY_KEY, None)
+
+
+def build_message(sender, to_email, subject, html):
+    """Mensaje HTML en UTF-8 (cabeceras y cuerpo)."""
+    import email.charset
+    from email.header import Header
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    email.charset.add_charset('utf-8', email.charset.SHORTEST, None, 'utf-8')
+
+    msg = MIMEMultipart("alternative")
+    msg.set_charset("utf-8")
+    msg["Subject"] = str(Header(subject, "utf-8"))
+    msg["From"] = str(Header(sender, "utf-8"))
+    msg["To"] = str(Header(to_email, "utf-8"))
+    msg.attach(MIMEText(html, "html", "utf-8"))
+    return msg
+
+
+def _backoff(attempts):
+    return min(BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SECONDS)
+
+
+def _claim_batch(limit):
+    """Toma hasta `limit` emails listos (o con lease vencido). -> [(id, to_email, subject, html, attempts)]"""
+    from sqlalchemy import select, update
+    from app import db
+    from app.models import EmailOutbox, now_cba_naive
+
+    now = now_cba_naive()
+    due = (
+        select(EmailOutbox.id)
+        .where(EmailOutbox.status.in_(('pending', 'sending')), EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(due))
+        .values(
+            status='sending',
+            attempts=EmailOutbox.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=LEASE_SECONDS),
+        )
+        .returning(EmailOutbox.id, EmailOutbox.to_email, EmailOutbox.subject, EmailOutbox.html, EmailOutbox.attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return rows
+
+
+def _is_permanent(error):
+    """5xx del servidor (destinatario inexistente, mensaje rechazado): reintentar no sirve."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False  # credenciales: se arregla en la config, el email sigue valiendo
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+def _finish(outbox_id, error=None, attempts=0, max_attempts=1, permanent=False):
+    from sqlalchemy import update
+    from app import db
+    from app.models import EmailOutbox, now_cba_naive
+
+    now = now_cba_naive()
+    if error is None:
+        values = {'status': 'sent', 'sent_at': now, 'last_error': None}
+    elif permanent or attempts >= max_attempts:
+        values = {'status': 'failed', 'last_error': error}
+    else:
+        values = {
+            'status': 'pending',
+            'next_attempt_at': now + timedelta(seconds=_backoff(attempts)),
+            'last_error': error,
+        }
+    db.session.execute(
+        update(EmailOutbox).where(EmailOutbox.id == outbox_id).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+class EmailSender:
+    """Hilo por proceso que manda la bandeja de salida por una conexión SMTP reutilizada."""
+
+    def __init__(self):
+        self.app = None
+        self.poll_seconds = 10
+        self.batch_size = 20
+        self.max_attempts = 6
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_seconds = app.config.get('EMAIL_POLL_SECONDS', self.poll_seconds)
+        self.batch_size = app.config.get('EMAIL_BATCH_SIZE', self.batch_size)
+        self.max_attempts = app.config.get('EMAIL_MAX_ATTEMPTS', self.max_attempts)
+        app.extensions['email_sender'] = self
+        from sqlalchemy import event
+        from sqlalchemy.orm import Session
+        if not event.contains(Session, 'after_commit', _after_commit):
+            event.listen(Session, 'after_commit', _after_commit)
+            event.listen(Session, 'after_soft_rollback', _after_soft_rollback)
+        if self.poll_seconds:
+            # arranca con el primer request: no corre en `flask db upgrade` ni en scripts
+            app.before_request(self.start)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='email-sender', daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _connect(self):
+        config = self.app.config
+        host, port = config.get('MAIL_SERVER'), config.get('MAIL_PORT')
+        timeout = config.get('MAIL_TIMEOUT', 20)
+        if config.get('MAIL_USE_SSL'):
+            smtp = smtplib.SMTP_SSL(host, port, timeout=timeout)
+        else:
+            smtp = smtplib.SMTP(host, port, timeout=timeout)
+            if config.get('MAIL_USE_TLS'):
+                smtp.starttls()
+        username, password = config.get('MAIL_USERNAME'), config.get('MAIL_PASSWORD')
+        if username and password:
+            smtp.login(username, password)
+        return smtp
+
+    @staticmethod
+    def _close(smtp):
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+
+    def drain(self):
+        """Manda todo lo que esté listo por una sola conexión. -> cantidad enviada (también sirve para tests / scripts)."""
+        config = self.app.config
+        sender = config.get('MAIL_DEFAULT_SENDER') or config.get('MAIL_USERNAME')
+        sent = 0
+        smtp = None
+        try:
+            while True:
+                batch = _claim_batch(self.batch_size)
+                if not batch:
+                    return sent
+                for n, (outbox_id, to_email, subject, html, attempts) in enumerate(batch):
+                    try:
+                        if smtp is None:
+                            smtp = self._connect()
+                    except (smtplib.SMTPException, OSError) as e:
+                        # sin servidor no tiene sentido seguir: el lote vuelve con backoff
+                        print(f"❌ No se pudo conectar al SMTP: {e}")
+                        for row in batch[n:]:
+                            _finish(row[0], error=f"conexión: {e}"[:2000], attempts=row[4], max_attempts=self.max_attempts)
+                        return sent
+
+                    msg = build_message(sender, to_email, subject, html).as_bytes()
+                    try:
+                        try:
+                            smtp.sendmail(sender, [to_email], msg)
+                        except smtplib.SMTPServerDisconnected:
+                            # el servidor cerró la conexión ociosa: una reconexión y reintento
+                            self._close(smtp)
+                            smtp = None
+                            smtp = self._connect()
+                            smtp.sendmail(sender, [to_email], msg)
+                    except Exception as e:
+                        print(f"❌ Error enviando email a {to_email} (intento {attempts}): {e}")
+                        if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)):
+                            self._close(smtp)  # estado de la conexión dudoso
+                            smtp = None
+                        # 4xx / conexión: reintento con backoff ; 5xx: 'failed' ya
+                        _finish(outbox_id, error=str(e)[:2000], attempts=attempts,
+                                max_attempts=self.max_attempts, permanent=_is_permanent(e))
+                    else:
+                        print(f"✅ Email enviado a {to_email}")
+                        _finish(outbox_id)
+                        sent += 1
+        finally:
+            self._close(smtp)
+
+    def _run(self):
+        from app import db
+        while True:
+            with self.app.app_context():
+                try:
+                    self.drain()
+                except Exception:
+                    db.session.rollback()
+                    print(f"❌ Error en el sender de emails:\n{traceback.format_exc()}")
+            # espera el próximo email encolado (o el poll para reintentos / otros workers)
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
@@ -0,0 +1,176 @@
+"""
+Filtros por facetas del catálogo (marca, caladas, nicotina, volumen, precio, sabor)
+y conteos por faceta para /public/facets.
+
+Los conteos salen de UNA sola query (UNION ALL de un GROUP BY por faceta). Cada
+faceta se cuenta con todos los filtros activos MENOS el suyo, así el front puede
+mostrar "Marca: A (12) · B (7)" aunque ya haya una marca elegida.
+"""
+from sqlalchemy import Float, String, case, cast, func, literal, literal_column, null, or_, select, true, union_all
+
+from app import db
+from app.models import Product
+
+# (min, max) inclusive; max None = sin tope
+PUFF_BANDS = ((0, 1000), (1001, 5000), (5001, 10000), (10001, None))
+
+
+def _band_label(lo, hi):
+    return f"{lo}-{hi}" if hi is not None else f"{lo}+"
+
+
+def _multi(args, name, type=str):
+    """brand=A&brand=B o brand=A,B -> ['A', 'B']"""
+    values = []
+    for raw in args.getlist(name):
+        for v in str(raw).split(','):
+            v = v.strip()
+            if not v:
+                continue
+            try:
+                values.append(type(v))
+            except ValueError:
+                raise ValueError(f"Valor inválido para {name}: {v}")
+    return values
+
+
+def _number(args, name, type):
+    raw = args.get(name)
+    if raw in (None, ''):
+        return None
+    try:
+        return type(raw)
+    except ValueError:
+        raise ValueError(f"Valor inválido para {name}: {raw}")
+
+
+def parse_facet_filters(args):
+    """
+    Lee los filtros de la query string -> {faceta: [criterios]}.
+    Lanza ValueError ante valores inválidos (400).
+    """
+    filters = {}
+
+    brands = _multi(args, 'brand')
+    if brands:
+        filters['brand'] = [Product.brand.in_(brands)]
+
+    flavors = _multi(args, 'flavor')
+    if flavors:
+        # flavors es JSONB: @> usa el índice GIN ix_product_flavors
+        filters['flavor'] = [or_(*[Product.flavors.contains([f]) for f in flavors])]
+
+    nicotine = _multi(args, 'nicotine_mg', int)
+    if nicotine:
+        filters['nicotine_mg'] = [Product.nicotine_mg.in_(nicotine)]
+
+    volume = _multi(args, 'volume_ml', int)
+    if volume:
+        filters['volume_ml'] = [Product.volume_ml.in_(volume)]
+
+    puffs = []
+    puffs_min = _number(args, 'puffs_min', int)
+    puffs_max = _number(args, 'puffs_max', int)
+    if puffs_min is not None:
+        puffs.append(Product.puffs >= puffs_min)
+    if puffs_max is not None:
+        puffs.append(Product.puffs <= puffs_max)
+    if puffs:
+        filters['puffs'] = puffs
+
+    price = []
+    price_min = _number(args, 'price_min', float)
+    price_max = _number(args, 'price_max', float)
+    if price_min is not None:
+        price.append(Product.price >= price_min)
+    if price_max is not None:
+        price.append(Product.price <= price_max)
+    if price:
+        filters['price'] = price
+
+    return filters
+
+
+def all_criteria(filters):
+    return [c for criteria in filters.values() for c in criteria]
+
+
+def _except(filters, facet):
+    return [c for name, criteria in filters.items() if name != facet for c in criteria]
+
+
+def facet_counts(base_criteria, filters):
+    """
+    base_criteria: filtros que aplican a todo (activo, categoría, búsqueda).
+    filters: resultado de parse_facet_filters.
+    """
+    def branch(facet, value_expr, *, from_=None, extra_where=()):
+        # GROUP BY por alias: la expresión (p. ej. el CASE de bandas) lleva parámetros
+        # distintos en el SELECT y en el GROUP BY y Postgres no las reconocería iguales
+        return (
+            select(
+                literal(facet).label('facet'),
+                cast(value_expr, String).label('facet_value'),
+                func.count(func.distinct(Product.id)).label('count'),
+                cast(null(), Float).label('min_price'),
+                cast(null(), Float).label('max_price'),
+            )
+            .select_from(from_ if from_ is not None else Product)
+            .where(*base_criteria, *_except(filters, facet), *extra_where)
+            .group_by(literal_column('facet_value'))
+        )
+
+    puff_band = case(
+        *[
+            ((Product.puffs <= hi) if hi is not None else (Product.puffs >= lo), _band_label(lo, hi))
+            for lo, hi in PUFF_BANDS
+        ],
+        else_=None,
+    )
+
+    flavor = func.jsonb_array_elements_text(Product.flavors).table_valued('value').lateral('flavor')
+
+    price = (
+        select(
+            literal('price').label('facet'),
+            cast(null(), String).label('facet_value'),
+            func.count(Product.id).label('count'),
+            func.min(Product.price).label('min_price'),
+            func.max(Product.price).label('max_price'),
+        )
+        .where(*base_criteria, *_except(filters, 'price'))
+    )
+
+    stmt = union_all(
+        branch('brand', Product.brand, extra_where=[Product.brand.isnot(None), Product.brand != '']),
+        branch('puffs', puff_band, extra_where=[Product.puffs.isnot(None)]),
+        branch('nicotine_mg', Product.nicotine_mg, extra_where=[Product.nicotine_mg.isnot(None)]),
+        branch('volume_ml', Product.volume_ml, extra_where=[Product.volume_ml.isnot(None)]),
+        branch('flavor', flavor.c.value, from_=Product.__table__.join(flavor, true())),
+        price,
+    )
+
+    result = {'brand': [], 'puffs': [], 'nicotine_mg': [], 'volume_ml': [], 'flavor': [], 'price': None}
+    for row in db.session.execute(stmt):
+        if row.facet == 'price':
+            result['price'] = {
+                'min': float(row.min_price) if row.min_price is not None else None,
+                'max': float(row.max_price) if row.max_price is not None else None,
+                'count': row.count,
+            }
+            continue
+        value = row.facet_value
+        if row.facet in ('nicotine_mg', 'volume_ml'):
+            value = int(value)
+        result[row.facet].append({'value': value, 'count': row.count})
+
+    # bandas de caladas con min/max para armar el filtro en el front
+    bands = {_band_label(lo, hi): (lo, hi) for lo, hi in PUFF_BANDS}
+    for item in result['puffs']:
+        item['min'], item['max'] = bands[item['value']]
+    result['puffs'].sort(key=lambda i: i['min'])
+    for facet in ('brand', 'flavor'):
+        result[facet].sort(key=lambda i: (-i['count'], i['value']))
+    for facet in ('nicotine_mg', 'volume_ml'):
+        result[facet].sort(key=lambda i: i['value'])
+    return result
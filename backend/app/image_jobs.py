@@ -0,0 +1,220 @@
+"""
+Procesamiento de imágenes fuera del request.
+
+upload_image guarda el archivo original como ProductImage(status='pending') y
+responde enseguida; acá un pool (procesos por defecto) corre Pillow
+(app.images.process_upload) y al terminar se reemplaza la rendición principal
+y se agregan las variantes.
+
+IMAGE_PROCESSING:
+  - 'process': ProcessPoolExecutor (no bloquea el event loop de gevent ni compite por el GIL)
+  - 'thread':  ThreadPoolExecutor (Pillow libera el GIL al codificar)
+  - 'sync':    en el mismo request (desarrollo)
+
+Si el worker de gunicorn se reinicia con trabajos en el pool, la fila queda
+'pending': un hilo por proceso (cada IMAGE_REQUEUE_MINUTES) reencola las que
+llevan más de ese tiempo, leyendo el original guardado bajo source_digest.
+"""
+import multiprocessing
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+from app.images import process_upload
+
+REQUEUE_BATCH = 100
+# el formato / tamaño pedidos en el upload no se guardan: al reencolar se usan los default de /admin/upload
+REQUEUE_FORMAT = 'webp'
+REQUEUE_MAX_SIZE = 1600
+
+
+class ImageJobs:
+    def __init__(self):
+        self.app = None
+        self.mode = 'process'
+        self.max_workers = None
+        self.requeue_minutes = 10
+        self._executor = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = (app.config.get('IMAGE_PROCESSING') or 'process').lower()
+        self.max_workers = app.config.get('IMAGE_WORKERS')
+        self.requeue_minutes = app.config.get('IMAGE_REQUEUE_MINUTES', self.requeue_minutes)
+        app.extensions['image_jobs'] = self
+        if self.requeue_minutes:
+            # arranca con el primer request: no corre en `flask db upgrade` ni en scripts
+            app.before_request(self.start)
+
+    @property
+    def executor(self):
+        # Se crea en el primer uso: cada worker de gunicorn arma su propio pool después del fork
+        if self._executor is None:
+            if self.mode == 'process':
+                # 'spawn': los hijos no heredan el hub de gevent ni conexiones de la BD
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def map(self, fn, iterable):
+        """Corre `fn` en paralelo sobre el pool y devuelve los resultados en orden."""
+        if self.mode == 'sync':
+            return [fn(x) for x in iterable]
+        return list(self.executor.map(fn, iterable))
+
+    def submit_upload(self, image_id, original_bytes, target_format, max_size):
+        """Encola el procesamiento de una imagen pendiente. -> estado de la fila ('pending' si quedó en el pool)."""
+        if self.mode == 'sync':
+            try:
+                result = process_upload(original_bytes, target_format=target_format, max_size=max_size)
+                return finish_upload(image_id, *result)
+            except Exception:
+                print(f"❌ Error procesando imagen {image_id}:\n{traceback.format_exc()}")
+                self._fail(image_id)
+                return 'failed'
+
+        future = self.executor.submit(process_upload, original_bytes,
+                                      target_format=target_format, max_size=max_size)
+        future.add_done_callback(lambda f: self._on_done(image_id, f))
+        return 'pending'
+
+    def _on_done(self, image_id, future):
+        # Corre en el hilo del executor: necesita su propio app context / sesión
+        with self.app.app_context():
+            try:
+                main, variants = future.result()
+            except Exception:
+                print(f"❌ Error procesando imagen {image_id}:\n{traceback.format_exc()}")
+                self._fail(image_id)
+                return
+            try:
+                finish_upload(image_id, main, variants)
+            except Exception:
+                print(f"❌ Error guardando imagen {image_id}:\n{traceback.format_exc()}")
+                self._fail(image_id)
+
+    def requeue_stale(self):
+        """Reencola las imágenes 'pending' encoladas hace más de requeue_minutes. -> cantidad."""
+        from sqlalchemy import func, select, update
+        from app import db
+        from app.models import ProductImage, now_cba_naive
+        from app.image_storage import load_blob
+
+        now = now_cba_naive()
+        stale = (
+            select(ProductImage.id)
+            .where(
+                ProductImage.status == 'pending',
+                func.coalesce(ProductImage.queued_at, ProductImage.created_at)
+                < now - timedelta(minutes=self.requeue_minutes),
+            )
+            .limit(REQUEUE_BATCH)
+            .with_for_update(skip_locked=True)
+        )
+        # queued_at = ahora: los demás workers no la vuelven a tomar hasta que venza otra vez
+        rows = db.session.execute(
+            update(ProductImage)
+            .where(ProductImage.id.in_(stale))
+            .values(queued_at=now)
+            .returning(ProductImage.id, ProductImage.source_digest)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+
+        for image_id, source_digest in rows:
+            original = load_blob(source_digest) if source_digest else None
+            if original is None:
+                # si el primer trabajo terminó mientras tanto, el original ya se liberó:
+                # _fail solo marca la fila si sigue 'pending'
+                if self._fail(image_id):
+                    print(f"❌ Imagen {image_id}: no está el original para reprocesar")
+                continue
+            print(f"🔁 Reencolando imagen {image_id}")
+            self.submit_upload(image_id, original, REQUEUE_FORMAT, REQUEUE_MAX_SIZE)
+        return len(rows)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='image-requeue', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        from app import db
+        while True:
+            with self.app.app_context():
+                try:
+                    self.requeue_stale()
+                except Exception:
+                    db.session.rollback()
+                    print(f"❌ Error reencolando imágenes:\n{traceback.format_exc()}")
+            time.sleep(self.requeue_minutes * 60)
+
+    @staticmethod
+    def _fail(image_id):
+        """
+        El original sigue sirviéndose; la fila queda 'failed' (no se reencola sola).
+        Solo si sigue 'pending': el error tardío de un trabajo duplicado no pisa una 'ready'.
+        -> True si se marcó.
+        """
+        from app import db
+        from app.models import ProductImage
+        db.session.rollback()
+        failed = (
+            ProductImage.query.filter_by(id=image_id, status='pending')
+            .update({'status': 'failed'}, synchronize_session=False)
+        )
+        db.session.commit()
+        return bool(failed)
+
+
+def finish_upload(image_id, main, variants):
+    """
+    Reemplaza el original pendiente por la rendición optimizada + variantes.
+    La fila se bloquea y solo se termina si sigue 'pending': un trabajo reencolado
+    (requeue_stale) y el original pueden terminar los dos. -> estado de la fila.
+    """
+    from app import db
+    from app.models import ProductImage, ProductImageVariant
+    from app.image_storage import store_rendition, release_blobs
+
+    img = db.session.get(ProductImage, image_id, with_for_update=True, populate_existing=True)
+    if not img or img.status != 'pending':
+        # borrada mientras se procesaba, o ya la terminó otro trabajo
+        status = img.status if img else None
+        db.session.rollback()
+        return status
+
+    replaced = [img.digest] + [v.digest for v in img.variants]
+    stored = []
+    try:
+        values = store_rendition(main)
+        stored.append(values['digest'])
+        for field in ('mime_type', 'bytes', 'width', 'height', 'digest'):
+            setattr(img, field, values[field])
+        new_variants = []
+        for v in variants:
+            new_variants.append(ProductImageVariant(**store_rendition(v)))
+            stored.append(v['digest'])
+        img.variants = new_variants
+        img.status = 'ready'
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        release_blobs(stored)  # archivos escritos para una fila que no se guardó
+        raise
+
+    # el original (y variantes anteriores, si las había) ya no los usa nadie
+    # (salvo otra fila con el mismo contenido: release_blobs cuenta referencias)
+    release_blobs([d for d in replaced if d not in stored])
+    return 'ready'
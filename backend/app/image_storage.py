@@ -0,0 +1,191 @@
+"""
+Almacenamiento de los bytes de las imágenes, direccionado por contenido (digest SHA-256).
+
+Backends (config IMAGE_STORAGE):
+  - 'local': archivos en IMAGE_STORE_DIR/<ab>/<cd>/<digest> ; la BD guarda solo metadatos
+  - 'db':    comportamiento anterior, los bytes quedan en ProductImage.bytes
+
+Como la clave es el digest, dos filas con la misma imagen comparten el archivo:
+antes de borrar un archivo hay que verificar que nadie más lo use (blob_ref_count).
+El conteo y el borrado se serializan con quien escribe ese digest mediante un
+advisory lock de Postgres por digest (lock_digests): store_rendition y las
+referencias deduplicadas lo toman dentro de su transacción (se suelta en el
+commit) y release_blobs lo toma alrededor de contar + borrar. Así un borrado no
+puede caer entre "archivo escrito" y "fila commiteada" de un upload concurrente.
+"""
+import os
+import tempfile
+
+from flask import current_app
+
+
+class DatabaseImageStorage:
+    """Los bytes viven en la BD (columna `bytes`)."""
+    keeps_bytes_in_db = True
+
+    def save(self, digest, data):
+        pass
+
+    def path(self, digest):
+        return None
+
+    def delete(self, digest):
+        pass
+
+
+class LocalImageStorage:
+    """Directorio local direccionado por contenido, particionado por prefijo del hash."""
+    keeps_bytes_in_db = False
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def save(self, digest, data):
+        path = self._path_for(digest)
+        if os.path.exists(path):
+            return  # mismo contenido ya guardado
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # escritura atómica: tmp en el mismo directorio + rename
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def path(self, digest):
+        path = self._path_for(digest)
+        return path if os.path.exists(path) else None
+
+    def delete(self, digest):
+        try:
+            os.remove(self._path_for(digest))
+        except FileNotFoundError:
+            pass
+
+
+def init_image_storage(app):
+    backend = (app.config.get('IMAGE_STORAGE') or 'local').lower()
+    if backend == 'db':
+        storage = DatabaseImageStorage()
+    else:
+        storage = LocalImageStorage(app.config['IMAGE_STORE_DIR'])
+    app.extensions['image_storage'] = storage
+    return storage
+
+
+def get_image_storage():
+    return current_app.extensions['image_storage']
+
+
+def lock_digests(digests):
+    """
+    Advisory lock (hasta el fin de la transacción) por digest; en orden para no
+    trabarse con otro que tome varios. Fuera de Postgres no hace nada.
+    """
+    from sqlalchemy import text
+    from app import db
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    for digest in sorted({d for d in digests if d}):
+        db.session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:digest))"), {'digest': digest})
+
+
+def store_rendition(rendition):
+    """
+    Guarda los bytes de una rendición (dict de app.images) en el backend activo y
+    devuelve los kwargs para el modelo (bytes=None si no van en la BD).
+    Toma el lock del digest: hacer commit de la fila en la misma transacción.
+    """
+    storage = get_image_storage()
+    lock_digests([rendition['digest']])
+    storage.save(rendition['digest'], rendition['bytes'])
+    if storage.keeps_bytes_in_db:
+        return dict(rendition)
+    return {**rendition, 'bytes': None}
+
+
+def load_blob(digest):
+    """Bytes guardados bajo `digest` (archivo del store o columna bytes). None si no están."""
+    from app import db
+    from app.models import ProductImage
+    path = get_image_storage().path(digest)
+    if path:
+        with open(path, 'rb') as f:
+            return f.read()
+    return (
+        db.session.query(ProductImage.bytes)
+        .filter(ProductImage.digest == digest, ProductImage.bytes.isnot(None))
+        .limit(1)
+        .scalar()
+    )
+
+
+# === Conteo de referencias por digest (imágenes + variantes) ===
+# Imports de modelos diferidos: este módulo se importa desde app/__init__.py antes que app.models
+
+def blob_ref_count(digest):
+    """Cuántas filas (imágenes + variantes) referencian este contenido."""
+    from app import db
+    from app.models import ProductImage, ProductImageVariant
+    return (
+        db.session.query(ProductImage.id).filter_by(digest=digest).count()
+        + db.session.query(ProductImageVariant.id).filter_by(digest=digest).count()
+    )
+
+
+def image_digests(image_ids):
+    """Digests de las imágenes y de sus variantes."""
+    from app import db
+    from app.models import ProductImage, ProductImageVariant
+    mains = db.session.query(ProductImage.digest).filter(ProductImage.id.in_(image_ids))
+    variants = db.session.query(ProductImageVariant.digest).filter(ProductImageVariant.image_id.in_(image_ids))
+    return [d for (d,) in mains] + [d for (d,) in variants]
+
+
+def hand_over_blobs(image_ids):
+    """
+    IMAGE_STORAGE='db': antes de borrar imágenes, si otra fila comparte el digest
+    pero no tiene los bytes (referencia deduplicada), le pasamos el blob.
+    """
+    from app import db
+    from app.models import ProductImage, ProductImageVariant
+    if not get_image_storage().keeps_bytes_in_db:
+        return
+    for model, doomed in (
+        (ProductImage, ProductImage.id.in_(image_ids)),
+        (ProductImageVariant, ProductImageVariant.image_id.in_(image_ids)),
+    ):
+        holders = db.session.query(model.id, model.digest).filter(doomed, model.bytes.isnot(None)).all()
+        for row_id, digest in holders:
+            heir = (
+                db.session.query(model.id)
+                .filter(model.digest == digest, model.bytes.is_(None), ~doomed)
+                .first()
+            )
+            if heir:
+                data = db.session.query(model.bytes).filter(model.id == row_id).scalar()
+                model.query.filter_by(id=heir.id).update({'bytes': data}, synchronize_session=False)
+
+
+def release_blobs(digests):
+    """
+    Borra del store los archivos que ya no referencia ninguna fila. Llamar después
+    del commit: cada digest se cuenta y se borra bajo su lock, en su propia transacción.
+    """
+    from app import db
+    storage = get_image_storage()
+    for digest in sorted({d for d in digests if d}):
+        try:
+            lock_digests([digest])
+            if blob_ref_count(digest) == 0:
+                storage.delete(digest)
+        finally:
+            db.session.commit()  # suelta el lock
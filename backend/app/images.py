@@ -0,0 +1,94 @@
+"""
+Procesamiento de imágenes con Pillow (sin contexto de Flask ni BD).
+Funciones puras: reciben bytes y devuelven dicts listos para ProductImage /
+ProductImageVariant.
+"""
+import hashlib
+import io
+
+from PIL import Image, ImageOps  # pip install pillow
+
+# Lados mayores (px) y formatos de las variantes responsive
+VARIANT_SIZES = (200, 400, 800, 1600)
+VARIANT_FORMATS = ('webp', 'jpeg')
+MIME_BY_FORMAT = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def open_image(original_bytes):
+    """Abre con Pillow y normaliza orientación/modo. Lanza excepción si no es una imagen."""
+    img = Image.open(io.BytesIO(original_bytes))
+    img = ImageOps.exif_transpose(img)
+    # Convertimos a RGB para evitar problemas de modo (p.ej. PNG con alpha → lo podés mantener si querés)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return img
+
+
+def probe_image(original_bytes):
+    """Solo lee la cabecera (sin decodificar): -> (mime, width, height). Lanza excepción si no es imagen."""
+    img = Image.open(io.BytesIO(original_bytes))
+    mime = Image.MIME.get(img.format) or 'application/octet-stream'
+    width, height = img.size
+    return mime, width, height
+
+
+def _encode(img, target_format):
+    """Serializa a bytes en memoria -> (bytes, mime)."""
+    out = io.BytesIO()
+    if target_format == 'jpeg':
+        # JPEG progresivo
+        img = img.convert('RGB')
+        img.save(out, format='JPEG', quality=82, optimize=True, progressive=True)
+    else:
+        # WEBP (recomendado: más liviano, soporte general actual)
+        # Si hay alpha y querés preservarla:
+        if img.mode == 'RGBA':
+            img.save(out, format='WEBP', quality=80, method=6, lossless=False)
+        else:
+            img.save(out, format='WEBP', quality=80, method=6)
+    return out.getvalue(), MIME_BY_FORMAT.get(target_format, 'image/webp')
+
+
+def _rendition(img, max_size, target_format):
+    resized = img.copy()
+    # Resize "thumbnail" mantiene aspect ratio
+    resized.thumbnail((max_size, max_size))
+    data, mime = _encode(resized, target_format)
+    width, height = resized.size
+    return {
+        'mime_type': mime,
+        'bytes': data,
+        'width': width,
+        'height': height,
+        # Digest para ETag/caché y deduplicación
+        'digest': hashlib.sha256(data).hexdigest(),
+    }
+
+
+def build_variants(img, main=None, max_size=None):
+    """
+    Variantes responsive (VARIANT_SIZES x VARIANT_FORMATS), nunca más grandes que
+    la imagen ni que `max_size`. Si se pasa `main` se omite la variante idéntica
+    a esa rendición.
+    """
+    longest = min(max(img.size), max_size or max(img.size))
+    sizes = sorted({min(size, longest) for size in VARIANT_SIZES})
+
+    variants = []
+    for fmt in VARIANT_FORMATS:
+        for size in sizes:
+            if main and main['mime_type'] == MIME_BY_FORMAT[fmt] and max(main['width'], main['height']) == size:
+                continue
+            variants.append(_rendition(img, size, fmt))
+    return variants
+
+
+def process_upload(original_bytes, target_format='webp', max_size=1600, with_variants=True):
+    """
+    Decodifica una sola vez y devuelve (principal, variantes).
+    principal: la rendición que se guarda en ProductImage (max_size, target_format).
+    """
+    img = open_image(original_bytes)
+    main = _rendition(img, max_size, target_format)
+    variants = build_variants(img, main, max_size) if with_variants else []
+    return main, variants
@@ -1,9 +1,10 @@
 from app import db
 from sqlalchemy import String, Boolean, ForeignKey, DateTime, Integer, Float
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship, deferred
 from datetime import datetime, timezone
 from typing import Optional
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Computed
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -78,7 +79,29 @@ class Category(db.Model):
 
 
 
+# name/brand pesan más que los sabores y la descripción corta
+PRODUCT_SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('es_unaccent'::regconfig, coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('es_unaccent'::regconfig, coalesce(brand, '')), 'A') || "
+    "setweight(jsonb_to_tsvector('es_unaccent'::regconfig, coalesce(flavors, '[]'::jsonb), '[\"string\"]'), 'B') || "
+    "setweight(to_tsvector('es_unaccent'::regconfig, coalesce(short_description, '')), 'C')"
+)
+
+
 class Product(db.Model):
+    __table_args__ = (
+        db.Index('ix_product_search_vector', 'search_vector', postgresql_using='gin'),
+        # Listado de la tienda: activos por categoría / todos, orden 'newest' + keyset por id
+        db.Index('ix_product_active_category', 'category_id', 'created_at', 'id', postgresql_where=db.text('is_active')),
+        db.Index('ix_product_active_created', 'created_at', 'id', postgresql_where=db.text('is_active')),
+        # Facetas (app/facets.py): parciales sobre productos activos, que son los únicos que se listan
+        db.Index('ix_product_active_brand', 'brand', 'price', postgresql_where=db.text('is_active')),
+        db.Index('ix_product_active_price', 'price', 'id', postgresql_where=db.text('is_active')),
+        db.Index('ix_product_active_puffs', 'puffs', postgresql_where=db.text('is_active')),
+        # flavors @> '["Menta"]'
+        db.Index('ix_product_flavors', 'flavors', postgresql_using='gin', postgresql_ops={'flavors': 'jsonb_path_ops'}),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(2000), nullable=False)
     description: Mapped[Optional[str]] = mapped_column(String(40000), nullable=True)
@@ -92,7 +115,7 @@ class Product(db.Model):
 
     flavors: Mapped[Optional[list[str]]] = mapped_column(JSONB, nullable=True, default=list)
     flavor_enabled: Mapped[bool] = mapped_column(Boolean(), nullable=True, default=False)
-    flavor_catalog: Mapped[Optional[list[dict]]] = mapped_column(JSONB, nullable=True, default=list)
+    # flavor_catalog (stock por sabor) vive en la tabla product_flavors, ver ProductFlavor
     flavor_stock_mode: Mapped[bool] = mapped_column(Boolean(), nullable=False, default=False)
 
     puffs: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
@@ -101,32 +124,122 @@ class Product(db.Model):
 
     created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=now_cba_naive)
 
+    # Búsqueda full-text (Postgres): columna generada + índice GIN, ver app/search.py
+    search_vector = deferred(db.Column(
+        TSVECTOR,
+        Computed(PRODUCT_SEARCH_VECTOR_SQL, persisted=True),
+        nullable=True,
+    ))
+
     # Relaciones
     category: Mapped["Category"] = relationship("Category", back_populates="products")
     cart_items: Mapped[list["CartItem"]] = relationship("CartItem", back_populates="product")
     order_items: Mapped[list["OrderItem"]] = relationship("OrderItem", back_populates="product")
+    flavor_entries: Mapped[list["ProductFlavor"]] = relationship(
+        "ProductFlavor",
+        back_populates="product",
+        order_by="ProductFlavor.position",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    # Misma forma que el viejo JSONB: [{name, active, stock}, ...]
+    @property
+    def flavor_catalog(self):
+        return [f.serialize() for f in self.flavor_entries]
+
+    @flavor_catalog.setter
+    def flavor_catalog(self, catalog):
+        # sincroniza por nombre: conserva las filas existentes, borra las que ya no vienen
+        existing = {f.name: f for f in self.flavor_entries}
+        entries = []
+        for position, item in enumerate(catalog or []):
+            name = str(item.get('name', '')).strip()
+            if not name or any(e.name == name for e in entries):
+                continue
+            entry = existing.get(name) or ProductFlavor(name=name)
+            entry.active = bool(item.get('active', True))
+            entry.stock = max(int(item.get('stock') or 0), 0)
+            entry.position = position
+            entries.append(entry)
+        self.flavor_entries = entries
 
     # 👇👇👇 AGREGA DESDE ACÁ (con sangría dentro de la clase) 👇👇👇
-    def serialize(self):
-        # Armar lista de URLs de imágenes (principal + asociadas)
-        image_urls = []
-        if self.image_url:
-            image_urls.append(self.image_url)
-
-        try:
-            # Traer IDs de imágenes vinculadas al producto
-            rows = (
-                db.session.query(ProductImage.id)
-                .filter_by(product_id=self.id)
-                .order_by(ProductImage.id.asc())
-                .all()
+    @staticmethod
+    def _build_image_urls(main_url, image_ids):
+        # principal primero, después las asociadas sin repetir
+        image_urls = [main_url] if main_url else []
+        for img_id in image_ids or []:
+            url = f"/public/img/{img_id}"
+            if url not in image_urls:
+                image_urls.append(url)
+        return image_urls
+
+    @classmethod
+    def serialize_many(cls, products):
+        """
+        Serializa una lista de productos con 3 queries en total (imágenes + sabores +
+        categorías) en vez de 1 + N. Usar en listados (/public/products, /admin/products, etc.).
+        """
+        products = list(products or [])
+        if not products:
+            return []
+
+        product_ids = [p.id for p in products]
+        images_by_product = {pid: [] for pid in product_ids}
+        rows = (
+            db.session.query(ProductImage.product_id, ProductImage.id)
+            .filter(ProductImage.product_id.in_(product_ids))
+            .order_by(ProductImage.product_id.asc(), ProductImage.id.asc())
+            .all()
+        )
+        for pid, img_id in rows:
+            images_by_product[pid].append(img_id)
+
+        flavors_by_product = {pid: [] for pid in product_ids}
+        for flavor in (
+            ProductFlavor.query
+            .filter(ProductFlavor.product_id.in_(product_ids))
+            .order_by(ProductFlavor.product_id.asc(), ProductFlavor.position.asc())
+        ):
+            flavors_by_product[flavor.product_id].append(flavor.serialize())
+
+        category_ids = {p.category_id for p in products if p.category_id is not None}
+        category_names = dict(
+            db.session.query(Category.id, Category.name)
+            .filter(Category.id.in_(category_ids))
+            .all()
+        ) if category_ids else {}
+
+        return [
+            p.serialize(
+                image_ids=images_by_product.get(p.id, []),
+                category_name=category_names.get(p.category_id),
+                flavor_catalog=flavors_by_product.get(p.id, []),
             )
-            for (img_id,) in rows:
-                url = f"/public/img/{img_id}"
-                if url not in image_urls:
-                    image_urls.append(url)
-        except Exception:
-            pass  # si no hay app context o algo similar
+            for p in products
+        ]
+
+    def serialize(self, image_ids=None, category_name=None, flavor_catalog=None):
+        # Armar lista de URLs de imágenes (principal + asociadas)
+        # Si vienen image_ids (serialize_many) no consultamos la BD
+        if image_ids is None:
+            image_ids = []
+            try:
+                # Traer IDs de imágenes vinculadas al producto
+                rows = (
+                    db.session.query(ProductImage.id)
+                    .filter_by(product_id=self.id)
+                    .order_by(ProductImage.id.asc())
+                    .all()
+                )
+                image_ids = [img_id for (img_id,) in rows]
+            except Exception:
+                pass  # si no hay app context o algo similar
+        image_urls = self._build_image_urls(self.image_url, image_ids)
+
+        if category_name is None and self.category:
+            category_name = self.category.name
 
         # Casts defensivos
         try:
@@ -149,11 +262,11 @@ class Product(db.Model):
             'image_urls': image_urls,             # todas las fotos
             'brand': self.brand,
             'category_id': self.category_id,
-            'category_name': self.category.name if self.category else None,
+            'category_name': category_name,
             'is_active': self.is_active,
             'flavors': self.flavors or [],
             'flavor_enabled': self.flavor_enabled,
-            'flavor_catalog': self.flavor_catalog or [],
+            'flavor_catalog': flavor_catalog if flavor_catalog is not None else self.flavor_catalog,
             'flavor_stock_mode': self.flavor_stock_mode,
             'puffs': self.puffs,
             'nicotine_mg': self.nicotine_mg,
@@ -179,15 +292,31 @@ class ProductImage(db.Model):
 
     # Datos binarios + metadatos
     mime_type = db.Column(db.String(64), nullable=False)     # p.ej. "image/webp" o "image/jpeg"
-    bytes = db.Column(db.LargeBinary, nullable=False)        # la imagen en sí (optimizada)
+    # deferred: el blob solo se lee cuando se accede explícitamente (no en listados/metadatos)
+    # NULL cuando la imagen vive en el store de archivos (app/image_storage.py, clave = digest)
+    bytes = deferred(db.Column(db.LargeBinary, nullable=True))  # la imagen en sí (optimizada)
     width = db.Column(db.Integer, nullable=True)
     height = db.Column(db.Integer, nullable=True)
 
     # Para cache/ETag y deduplicación opcional
     digest = db.Column(db.String(64), index=True, nullable=True, unique=False)
+    # SHA-256 del archivo tal como lo subió el admin (dedupe antes de procesar con Pillow)
+    source_digest = db.Column(db.String(64), index=True, nullable=True)
+    # 'pending' mientras el pool de imágenes genera la rendición optimizada y las variantes
+    status = db.Column(db.String(16), nullable=False, default='ready', server_default='ready')
+    # último encolado en el pool; si sigue 'pending' mucho después, se reencola (app/image_jobs.py)
+    queued_at = db.Column(db.DateTime, nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=now_cba_naive)
 
+    # Variantes responsive (200/400/800/1600 px, WEBP + JPEG)
+    variants = relationship(
+        "ProductImageVariant",
+        back_populates="image",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
     def serialize(self):
         return {
             "id": self.id,
@@ -198,7 +327,141 @@ class ProductImage(db.Model):
             "created_at": self.created_at.isoformat()
         }
 
+
+class ProductFlavor(db.Model):
+    """Stock por sabor (antes Product.flavor_catalog JSONB): se descuenta fila por fila."""
+    __tablename__ = "product_flavors"
+    __table_args__ = (db.UniqueConstraint('product_id', 'name', name='uq_product_flavors_product_name'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(
+        db.Integer,
+        db.ForeignKey('product.id', ondelete='CASCADE'),
+        nullable=False
+    )
+    name = db.Column(db.String(120), nullable=False)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    stock = db.Column(db.Integer, nullable=False, default=0)
+    position = db.Column(db.Integer, nullable=False, default=0)  # orden del catálogo en el admin
+
+    product = relationship("Product", back_populates="flavor_entries")
+
+    def serialize(self):
+        return {
+            'name': self.name,
+            'active': self.active,
+            'stock': self.stock,
+        }
+
+
+class StockReservation(db.Model):
+    """
+    Stock apartado mientras el comprador paga en MercadoPago (ver app/reservations.py).
+    held -> converted (pago aprobado) | expired (venció, lo devuelve el sweeper) | released
+    """
+    __tablename__ = "stock_reservations"
+    __table_args__ = (
+        db.Index('ix_stock_reservations_reference', 'reference'),
+        # el sweeper solo mira las vigentes
+        db.Index('ix_stock_reservations_held_expires', 'expires_at', postgresql_where=db.text("status = 'held'")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(64), nullable=False)  # va en metadata.reservation_ref de la preferencia
+    product_id = db.Column(
+        db.Integer,
+        db.ForeignKey('product.id', ondelete='CASCADE'),
+        nullable=False
+    )
+    flavor = db.Column(db.String(120), nullable=True)  # solo si se apartó stock del sabor
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='held')
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=now_cba_naive)
+
+
+class WebhookInbox(db.Model):
+    """
+    Notificaciones de pago de MercadoPago pendientes de procesar (ver app/webhook_inbox.py).
+    Una fila por payment_id: las notificaciones repetidas no duplican trabajo.
+    pending -> processing -> done | failed (agotó reintentos)
+    processing + notificación nueva -> requeue -> pending al terminar
+    """
+    __tablename__ = "webhook_inbox"
+    __table_args__ = (
+        # el worker busca las listas para procesar
+        db.Index('ix_webhook_inbox_due', 'next_attempt_at', postgresql_where=db.text("status IN ('pending', 'processing')")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.String(100), nullable=False, unique=True)
+    topic = db.Column(db.String(50), nullable=False, default='payment')
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # próximo intento (pending) o vencimiento del lease mientras se procesa (processing)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=now_cba_naive)
+    # llegó otra notificación mientras se procesaba: al terminar vuelve a 'pending'
+    requeue = db.Column(db.Boolean, nullable=False, default=False, server_default=db.text('false'))
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=now_cba_naive)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+
+class EmailOutbox(db.Model):
+    """
+    Emails pendientes de envío (ver app/email_outbox.py): los requests solo insertan
+    la fila y un hilo por worker los manda reusando la conexión SMTP.
+    pending -> sending -> sent | failed (agotó reintentos)
+    """
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        db.Index('ix_email_outbox_due', 'next_attempt_at', postgresql_where=db.text("status IN ('pending', 'sending')")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # próximo intento (pending) o vencimiento del lease mientras se envía (sending)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=now_cba_naive)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=now_cba_naive)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+
+class ProductImageVariant(db.Model):
+    __tablename__ = "product_image_variants"
+    __table_args__ = (db.Index('ix_product_image_variants_image_id', 'image_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(
+        db.Integer,
+        db.ForeignKey('product_images.id', ondelete='CASCADE'),
+        nullable=False
+    )
+    mime_type = db.Column(db.String(64), nullable=False)
+    bytes = deferred(db.Column(db.LargeBinary, nullable=True))  # NULL si está en el store de archivos
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    digest = db.Column(db.String(64), index=True, nullable=False)
+
+    image = relationship("ProductImage", back_populates="variants")
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "image_id": self.image_id,
+            "mime_type": self.mime_type,
+            "width": self.width,
+            "height": self.height,
+        }
+
 class CartItem(db.Model):
+    # carrito del usuario / ítem existente (user_id, product_id, selected_flavor)
+    __table_args__ = (db.Index('ix_cart_item_user_product', 'user_id', 'product_id'),)
+
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
     product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), nullable=False)
@@ -221,9 +484,84 @@ class CartItem(db.Model):
             'created_at': self.created_at.isoformat(),
         }
 
+    @staticmethod
+    def _flavor_status(flavor, quantity, flavor_active, flavor_stock, flavors, stock_mode):
+        """(disponible, stock del sabor | None) para el sabor elegido en una línea."""
+        if not flavor:
+            return True, None
+        if flavor_active is None:
+            # sin fila en product_flavors: vale la lista de sabores visibles
+            return flavor in (flavors or []), None
+        stock = int(flavor_stock or 0)
+        available = bool(flavor_active) and (not stock_mode or stock >= quantity)
+        return available, stock
+
+    @classmethod
+    def serialize_cart(cls, user_id):
+        """
+        Carrito compacto en UNA query (cart_item JOIN product LEFT JOIN product_flavors):
+        solo lo que muestra el carrito, sin description, sin catálogo completo ni
+        query de imágenes.
+        """
+        first_image = (
+            db.session.query(db.func.min(ProductImage.id))
+            .filter(ProductImage.product_id == Product.id)
+            .correlate(Product)
+            .scalar_subquery()
+        )
+        rows = (
+            db.session.query(
+                cls.id, cls.product_id, cls.quantity, cls.selected_flavor, cls.created_at,
+                Product.name, Product.price, Product.stock, Product.image_url, Product.is_active,
+                Product.flavor_enabled, Product.flavor_stock_mode, Product.flavors,
+                ProductFlavor.active.label('flavor_active'), ProductFlavor.stock.label('flavor_stock'),
+                first_image.label('first_image_id'),
+            )
+            .join(Product, Product.id == cls.product_id)
+            .outerjoin(ProductFlavor, db.and_(
+                ProductFlavor.product_id == cls.product_id,
+                ProductFlavor.name == cls.selected_flavor,
+            ))
+            .filter(cls.user_id == user_id)
+            .order_by(cls.created_at.asc(), cls.id.asc())
+            .all()
+        )
+
+        items = []
+        for r in rows:
+            flavor_available, flavor_stock = cls._flavor_status(
+                r.selected_flavor, r.quantity, r.flavor_active, r.flavor_stock, r.flavors, r.flavor_stock_mode
+            )
+            main_image = r.image_url or (f"/public/img/{r.first_image_id}" if r.first_image_id else None)
+            stock = int(r.stock or 0)
+            items.append({
+                'id': r.id,
+                'user_id': user_id,
+                'product_id': r.product_id,
+                'quantity': r.quantity,
+                'selected_flavor': r.selected_flavor,
+                'created_at': r.created_at.isoformat(),
+                'product': {
+                    'id': r.product_id,
+                    'name': r.name,
+                    'price': float(r.price or 0),
+                    'stock': stock,
+                    'image_url': main_image,
+                    'is_active': r.is_active,
+                    'flavor_enabled': r.flavor_enabled,
+                },
+                'flavor_available': flavor_available,
+                'flavor_stock': flavor_stock,
+                'available': bool(r.is_active) and stock >= r.quantity and flavor_available,
+            })
+        return items
+
 
 
 class Order(db.Model):
+    # historial del usuario: WHERE user_id = ? ORDER BY created_at DESC
+    __table_args__ = (db.Index('ix_order_user_created', 'user_id', 'created_at'),)
+
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[Optional[int]] = mapped_column(ForeignKey("user.id"), nullable=True)  # Puede ser guest
     total_amount: Mapped[float] = mapped_column(Float, nullable=False)
@@ -260,6 +598,8 @@ class Order(db.Model):
 
 
 class OrderItem(db.Model):
+    __table_args__ = (db.Index('ix_order_item_order_id', 'order_id'),)
+
     id: Mapped[int] = mapped_column(primary_key=True)
     order_id: Mapped[int] = mapped_column(ForeignKey("order.id"), nullable=False)
     product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), nullable=False)
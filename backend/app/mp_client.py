@@ -0,0 +1,133 @@
+"""
+Cliente HTTP de MercadoPago por proceso.
+
+El HttpClient del SDK arma un requests.Session nuevo en cada llamada (TCP + TLS
+cada vez) y el SDK usa 60 s de timeout. Acá:
+  - un SDK por proceso y access token, con un Session con keep-alive y pool
+  - timeouts de conexión / lectura cortos (MP_CONNECT_TIMEOUT / MP_READ_TIMEOUT)
+  - reintentos con backoff (y Retry-After) en 429/5xx solo para métodos
+    idempotentes; POST (crear preferencia) solo se reintenta si no llegó a
+    conectar, que es seguro
+  - latencia por endpoint ("GET /v1/payments/:id") en mp_metrics,
+    expuesta en /admin/metrics/mercadopago
+"""
+import re
+import threading
+import time
+from collections import deque
+
+import mercadopago
+import requests
+from mercadopago.http import HttpClient
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class LatencyMetrics:
+    """Conteo, errores y percentiles (sobre las últimas N muestras) por endpoint."""
+
+    def __init__(self, samples=500):
+        self.samples = samples
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, seconds, ok=True):
+        with self._lock:
+            d = self._data.get(endpoint)
+            if d is None:
+                d = self._data[endpoint] = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                                            'recent': deque(maxlen=self.samples)}
+            d['count'] += 1
+            d['errors'] += 0 if ok else 1
+            d['total'] += seconds
+            d['max'] = max(d['max'], seconds)
+            d['recent'].append(seconds)
+
+    def snapshot(self):
+        def pct(values, p):
+            return values[min(len(values) - 1, int(p * len(values)))] if values else None
+
+        with self._lock:
+            out = {}
+            for endpoint, d in self._data.items():
+                recent = sorted(d['recent'])
+                out[endpoint] = {
+                    'count': d['count'],
+                    'errors': d['errors'],
+                    'avg_ms': round(d['total'] / d['count'] * 1000, 1),
+                    'p50_ms': round(pct(recent, 0.50) * 1000, 1),
+                    'p95_ms': round(pct(recent, 0.95) * 1000, 1),
+                    'max_ms': round(d['max'] * 1000, 1),
+                }
+            return out
+
+
+mp_metrics = LatencyMetrics()
+
+
+def _endpoint(method, url):
+    path = re.sub(r'^https?://[^/]+', '', url).split('?', 1)[0]
+    # ids numéricos / de preferencia -> :id para agrupar
+    path = re.sub(r'/(\d+|\d+-[\w-]+)(?=/|$)', '/:id', path)
+    return f"{method} {path}"
+
+
+class PooledHttpClient(HttpClient):
+    def __init__(self, connect_timeout=3.05, read_timeout=15, retries=3, backoff=0.5, pool_maxsize=20):
+        self.timeout = (connect_timeout, read_timeout)
+        self._idempotent = self._session(
+            Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=IDEMPOTENT_METHODS, respect_retry_after_header=True),
+            pool_maxsize,
+        )
+        self._unsafe = self._session(
+            Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=backoff,
+                  allowed_methods=frozenset()),
+            pool_maxsize,
+        )
+
+    @staticmethod
+    def _session(retry, pool_maxsize):
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry))
+        return session
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        # el timeout del SDK (60 s por defecto) se reemplaza por el nuestro
+        kwargs['timeout'] = self.timeout
+        session = self._idempotent if method.upper() in IDEMPOTENT_METHODS else self._unsafe
+        endpoint = _endpoint(method.upper(), url)
+        start = time.perf_counter()
+        try:
+            api_result = session.request(method, url, **kwargs)
+        except Exception:
+            mp_metrics.observe(endpoint, time.perf_counter() - start, ok=False)
+            raise
+        mp_metrics.observe(endpoint, time.perf_counter() - start, ok=api_result.status_code < 500)
+        try:
+            body = api_result.json()
+        except ValueError:
+            body = {'message': api_result.text}
+        return {"status": api_result.status_code, "response": body}
+
+
+_sdks = {}
+_lock = threading.Lock()
+
+
+def get_sdk(access_token, config):
+    """SDK de MP reutilizado por proceso (se crea en el primer uso, después del fork de gunicorn)."""
+    sdk = _sdks.get(access_token)
+    if sdk is None:
+        with _lock:
+            sdk = _sdks.get(access_token)
+            if sdk is None:
+                client = PooledHttpClient(
+                    connect_timeout=config.get('MP_CONNECT_TIMEOUT', 3.05),
+                    read_timeout=config.get('MP_READ_TIMEOUT', 15),
+                    retries=config.get('MP_MAX_RETRIES', 3),
+                )
+                sdk = _sdks[access_token] = mercadopago.SDK(access_token, http_client=client)
+    return sdk
@@ -0,0 +1,92 @@
+"""
+Consultas de pagos a MercadoPago con cache corto + single-flight por payment_id.
+
+MP manda varias notificaciones por el mismo pago (payment, merchant_order,
+reintentos) y el front consulta /payment/<id> mientras espera: con esto, las
+consultas concurrentes del mismo pago dentro de un proceso esperan UNA sola
+llamada a la API, y las siguientes dentro de MP_PAYMENT_CACHE_TTL segundos
+salen de memoria. Solo se cachean respuestas 200 de pagos en estado final: un
+pago 'pending' puede aprobarse en cualquier momento y la notificación que lo
+avisa tiene que ver el estado nuevo.
+
+Entre procesos, la bandeja de webhooks (una fila por payment_id) ya garantiza
+un solo intento de orden por pago.
+"""
+import threading
+import time
+
+FINAL_STATUSES = {'approved', 'rejected', 'cancelled', 'refunded', 'charged_back'}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PaymentLookup:
+    def __init__(self, ttl=30, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}    # payment_id -> (expires_at, respuesta)
+        self._inflight = {}   # payment_id -> _Call
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('MP_PAYMENT_CACHE_TTL', self.ttl)
+        app.extensions['payment_lookup'] = self
+
+    def get(self, payment_id, fetch):
+        """
+        Devuelve la respuesta de MP para el pago; `fetch()` hace la llamada real
+        (solo la ejecuta uno de los pedidos concurrentes).
+        """
+        key = str(payment_id)
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fetch()
+            if self.ttl and self._cacheable(call.result):
+                self._store(key, call.result)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    @staticmethod
+    def _cacheable(response):
+        if response.get('status') != 200:
+            return False
+        return (response.get('response') or {}).get('status') in FINAL_STATUSES
+
+    def invalidate(self, payment_id):
+        self._entries.pop(str(payment_id), None)
+
+    def _store(self, key, response):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    # sacar la que vence primero
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+            self._entries[key] = (time.monotonic() + self.ttl, response)
@@ -0,0 +1,218 @@
+"""
+Reservas de stock con vencimiento para el checkout de MercadoPago.
+
+create_preference aparta el stock (descuento atómico con guarda, ver app/stock.py)
+y registra una StockReservation por línea con expires_at. Ninguna fila queda
+bloqueada mientras el comprador paga:
+  - pago aprobado -> convert_reservation: las reservas pasan a 'converted' y la
+    orden NO vuelve a descontar ese stock (solo lo que el sweeper ya había vencido)
+  - preferencia fallida -> release_reservation: se devuelve enseguida
+  - nadie pagó -> el sweeper (hilo por worker, cada RESERVATION_SWEEP_SECONDS)
+    marca 'expired' en lotes y devuelve el stock
+
+Varios workers pueden barrer a la vez: cada lote se toma con FOR UPDATE SKIP LOCKED
+y el cambio de estado filtra por status='held', así una reserva se devuelve una sola vez.
+"""
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+SWEEP_BATCH = 500
+
+
+def _aggregate(rows):
+    quantities, flavor_quantities = {}, {}
+    for product_id, flavor, quantity in rows:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        if flavor:
+            key = (product_id, flavor)
+            flavor_quantities[key] = flavor_quantities.get(key, 0) + quantity
+    return quantities, flavor_quantities
+
+
+def _merge_lines(lines):
+    merged = {}
+    for pid, flavor, qty in lines:
+        merged[(pid, flavor)] = merged.get((pid, flavor), 0) + qty
+    return merged
+
+
+def hold_stock(lines, ttl_minutes, flavor_mode=None):
+    """
+    lines: [(product_id, sabor | None, cantidad)].
+    Aparta todo o nada y hace commit. -> (reference, faltantes) ; con faltantes
+    no se aparta nada y reference es None. faltantes: product_id (o (product_id, sabor)).
+    flavor_mode: {product_id: flavor_stock_mode} si el llamador ya lo leyó (evita la query).
+    """
+    from app import db, catalog_cache
+    from app.models import Product, StockReservation, now_cba_naive
+    from app.stock import lock_stock, take_stock, take_flavor_stock
+
+    product_ids = {pid for pid, _, _ in lines}
+    if not product_ids:
+        return None, []
+    if flavor_mode is None:
+        flavor_mode = dict(
+            db.session.query(Product.id, Product.flavor_stock_mode).filter(Product.id.in_(product_ids))
+        )
+    # el sabor solo se aparta en productos con stock por sabor
+    lines = [(pid, flavor if flavor and flavor_mode.get(pid) else None, qty) for pid, flavor, qty in lines]
+    quantities, flavor_quantities = _aggregate(lines)
+
+    try:
+        lock_stock(quantities, flavor_quantities)
+        missing = take_flavor_stock(flavor_quantities)
+        if not missing:
+            missing = take_stock(quantities)
+        if missing:
+            db.session.rollback()
+            return None, missing
+
+        reference = uuid.uuid4().hex
+        expires_at = now_cba_naive() + timedelta(minutes=ttl_minutes)
+        db.session.add_all([
+            StockReservation(reference=reference, product_id=pid, flavor=flavor, quantity=qty, expires_at=expires_at)
+            for (pid, flavor), qty in _merge_lines(lines).items()
+        ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    catalog_cache.invalidate()  # bajó el stock visible
+    return reference, []
+
+
+def convert_reservation(reference, session=None):
+    """
+    Pago aprobado: pasa las reservas vigentes a 'converted' (sin commit, va en la
+    transacción de la orden). -> {(product_id, sabor | None): cantidad} de lo que
+    seguía apartado; las líneas que el sweeper ya venció no están y hay que descontarlas.
+    """
+    from sqlalchemy import update
+    from app import db
+    from app.models import StockReservation
+
+    if not reference:
+        return {}
+    session = session or db.session
+    rows = session.execute(
+        update(StockReservation)
+        .where(StockReservation.reference == reference, StockReservation.status == 'held')
+        .values(status='converted')
+        .returning(StockReservation.product_id, StockReservation.flavor, StockReservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    converted = {}
+    for product_id, flavor, quantity in rows:
+        converted[(product_id, flavor)] = converted.get((product_id, flavor), 0) + quantity
+    return converted
+
+
+def take_converted(converted, product_id, flavor, quantity):
+    """
+    Consume de `converted` (ver convert_reservation) lo apartado para una línea de la
+    orden. -> cantidad que NO estaba apartada y hay que descontar del stock.
+    """
+    # el sabor solo se aparta en productos con stock por sabor (si no, la línea va con None)
+    key = (product_id, flavor) if (product_id, flavor) in converted else (product_id, None)
+    covered = min(converted.get(key, 0), quantity)
+    if covered:
+        converted[key] -= covered
+    return quantity - covered
+
+
+def _give_back(criteria, status):
+    """Cambia de estado un lote de reservas vigentes y devuelve su stock. -> cantidad de reservas."""
+    from sqlalchemy import select, update
+    from app import db
+    from app.models import StockReservation
+    from app.stock import return_stock
+
+    batch = (
+        select(StockReservation.id)
+        .where(StockReservation.status == 'held', *criteria)
+        .limit(SWEEP_BATCH)
+        .with_for_update(skip_locked=True)
+    )
+    rows = db.session.execute(
+        update(StockReservation)
+        .where(StockReservation.id.in_(batch), StockReservation.status == 'held')
+        .values(status=status)
+        .returning(StockReservation.product_id, StockReservation.flavor, StockReservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if rows:
+        return_stock(*_aggregate(rows))
+    db.session.commit()
+    return len(rows)
+
+
+def release_reservation(reference):
+    """Devuelve ya el stock de una reserva (p. ej. si MercadoPago no creó la preferencia)."""
+    from app import catalog_cache
+    from app.models import StockReservation
+
+    if not reference:
+        return 0
+    released = _give_back([StockReservation.reference == reference], 'released')
+    if released:
+        catalog_cache.invalidate()
+    return released
+
+
+def expire_reservations():
+    """Vence en lotes las reservas con expires_at pasado. -> cantidad devuelta."""
+    from app import catalog_cache
+    from app.models import StockReservation, now_cba_naive
+
+    now = now_cba_naive()
+    total = 0
+    while True:
+        expired = _give_back([StockReservation.expires_at < now], 'expired')
+        total += expired
+        if expired < SWEEP_BATCH:
+            break
+    if total:
+        catalog_cache.invalidate()
+    return total
+
+
+class ReservationSweeper:
+    """Hilo (greenlet con gevent) por worker que corre expire_reservations periódicamente."""
+
+    def __init__(self):
+        self.app = None
+        self.interval = 60
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('RESERVATION_SWEEP_SECONDS', self.interval)
+        app.extensions['reservation_sweeper'] = self
+        if self.interval:
+            # arranca con el primer request: no corre en `flask db upgrade` ni en scripts
+            app.before_request(self.start)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='reservation-sweeper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        from app import db
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                try:
+                    expired = expire_reservations()
+                    if expired:
+                        print(f"⏱️ {expired} reservas de stock vencidas, stock devuelto")
+                except Exception:
+                    db.session.rollback()
+                    print(f"❌ Error venciendo reservas:\n{traceback.format_exc()}")
@@ -5,15 +5,19 @@ Este archivo contendrá las rutas administrativas para CRUD de productos
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import db
-from app.models import Product, Category, User,ProductImage,now_cba_naive
+from app import db, catalog_cache, image_jobs
+from app.models import Product, Category, User,ProductImage,ProductImageVariant,now_cba_naive
+from app.images import probe_image, process_upload
+from app.image_storage import store_rendition, image_digests, hand_over_blobs, release_blobs, lock_digests
+from app.stock import flavor_stock_total
+from app.mp_client import mp_metrics
 from flask import current_app, send_from_directory, url_for
 from werkzeug.utils import secure_filename
-from PIL import Image, ImageOps # pip install pillow
 from flask import url_for
 # backend/app/routes/admin_bp.py
 from flask import Blueprint, request, jsonify, current_app, url_for
-import os, io, hashlib, uuid
+import os, hashlib, uuid
+from functools import partial
 
 
 
@@ -36,8 +40,52 @@ def _normalize_catalog(catalog):
         norm.append({'name': name, 'active': active, 'stock': max(stock, 0)})
     return norm
 
-def _sum_active_stock(catalog):
-    return sum(int(f.get('stock', 0)) for f in (catalog or []) if f.get('active'))
+# === Helpers de imágenes (upload simple y bulk) ===
+def _find_duplicate(source_digest, product_id):
+    """
+    Busca una imagen ya procesada del mismo archivo.
+    -> (fila a reutilizar | None, fila origen para referenciar | None)
+    """
+    existing = (
+        ProductImage.query
+        .filter_by(source_digest=source_digest, status='ready')
+        .order_by(ProductImage.id.asc())
+        .all()
+    )
+    same = next((im for im in existing if product_id and im.product_id == product_id), None)
+    return same, (existing[0] if existing else None)
+
+def _reference_image(src, product_id, source_digest):
+    """
+    Nueva fila que apunta al mismo contenido que `src` (sin bytes propios).
+    Toma el lock de sus digests (app/image_storage.py) hasta el commit: un borrado
+    concurrente ya no libera esos archivos. None si `src` se borró mientras tanto
+    (sus archivos pueden no estar): hay que procesar el archivo de nuevo.
+    """
+    lock_digests([src.digest] + [v.digest for v in src.variants])
+    if src.id is not None and not db.session.query(ProductImage.id).filter_by(id=src.id).first():
+        return None
+    db_image = ProductImage(
+        product_id=product_id,
+        mime_type=src.mime_type,
+        bytes=None,
+        width=src.width,
+        height=src.height,
+        digest=src.digest,
+        source_digest=source_digest,
+        created_at=now_cba_naive(),
+    )
+    db_image.variants = [
+        ProductImageVariant(mime_type=v.mime_type, bytes=None, width=v.width,
+                            height=v.height, digest=v.digest)
+        for v in src.variants
+    ]
+    return db_image
+
+def _set_main_image(product, img_url, as_main):
+    # SOLO si no hay principal o si el admin lo pide la dejamos como principal (no pisamos siempre)
+    if as_main or not product.image_url:
+        product.image_url = img_url
 
 # Middleware para verificar que el usuario sea admin
 def admin_required():
@@ -69,10 +117,9 @@ def create_product():
         flavor_enabled = bool(data.get('flavor_enabled', False))
         active_flavors = [f['name'] for f in catalog if f.get('active')] if catalog else (data.get('flavors') or [])
 
-        # stock total coherente
-        if flavor_stock_mode:
-            computed_stock = _sum_active_stock(catalog)
-        else:
+        # stock total coherente (con flavor_stock_mode se calcula desde product_flavors al guardar)
+        computed_stock = 0
+        if not flavor_stock_mode:
             try:
                 computed_stock = int(data.get('stock', 0))
             except Exception:
@@ -101,7 +148,11 @@ def create_product():
         )
 
         db.session.add(product)
+        if flavor_stock_mode:
+            db.session.flush()
+            product.stock = flavor_stock_total(product.id)
         db.session.commit()
+        catalog_cache.invalidate()
         return jsonify({'message': 'Producto creado exitosamente', 'product': product.serialize()}), 201
     except Exception as e:
         db.session.rollback()
@@ -156,7 +207,8 @@ def update_product(product_id):
 
             # stock total coherente
             if product.flavor_stock_mode:
-                product.stock = _sum_active_stock(catalog)
+                db.session.flush()
+                product.stock = flavor_stock_total(product.id)
             elif 'stock' in data:
                 try:
                     product.stock = int(data['stock'])
@@ -171,6 +223,7 @@ def update_product(product_id):
                     product.stock = 0
         product.created_at = now_cba_naive()
         db.session.commit()
+        catalog_cache.invalidate()
         return jsonify({'message': 'Producto actualizado exitosamente', 'product': product.serialize()}), 200
     except Exception as e:
         db.session.rollback()
@@ -189,13 +242,20 @@ def delete_product(product_id):
 
         hard = str(request.args.get('hard', '')).lower() in ('1','true','yes')
 
+        digests = []
         if hard:
+            image_ids = [i for (i,) in db.session.query(ProductImage.id).filter_by(product_id=product_id)]
+            if image_ids:
+                digests = image_digests(image_ids)
+                hand_over_blobs(image_ids)
             # Con ON DELETE CASCADE, al borrar el product se borran sus imágenes
             db.session.delete(product)
         else:
             product.is_active = False  # comportamiento anterior (soft delete)
 
         db.session.commit()
+        release_blobs(digests)
+        catalog_cache.invalidate()
         return jsonify({'message': 'Producto eliminado'}), 200
     except Exception as e:
         db.session.rollback()
@@ -212,7 +272,7 @@ def get_all_products_admin():
     
     try:
         products = Product.query.all()  # Incluye productos inactivos
-        return jsonify([product.serialize() for product in products]), 200
+        return jsonify(Product.serialize_many(products)), 200
         
     except Exception as e:
         return jsonify({'error': f'Error al obtener productos: {str(e)}'}), 500
@@ -242,6 +302,7 @@ def create_category():
         
         db.session.add(category)
         db.session.commit()
+        catalog_cache.invalidate()
         
         return jsonify({
             'message': 'Categoría creada exitosamente',
@@ -259,13 +320,18 @@ def create_category():
 @jwt_required()
 def upload_image():
     """
-    Sube una imagen desde Admin, la optimiza y la guarda en la BD (ProductImage).
+    Sube una imagen desde Admin. Responde enseguida con la imagen en estado 'pending'
+    (se sirve el archivo original) y el pool de imágenes (app/image_jobs.py) genera
+    en segundo plano la rendición optimizada y las variantes 200/400/800/1600 px
+    en WEBP y JPEG que /public/img/<id>?w= elige según tamaño y Accept.
     Devuelve la URL interna: /public/img/<id>
     Campos aceptados (form-data):
       - image: archivo
       - product_id (opcional): int para asociar al producto
       - format (opcional): 'webp' | 'jpeg' (default: webp)
       - max_size (opcional): lado mayor, int (default: 1600)
+    Si el mismo archivo ya se subió (mismo SHA-256) no se procesa de nuevo: se
+    reutiliza la fila del mismo producto o se crea una referencia sin bytes.
     """
     if not admin_required():
         return jsonify({'error': 'Acceso denegado.'}), 403
@@ -284,52 +350,42 @@ def upload_image():
     original_bytes = file.read()
     if not original_bytes:
         return jsonify({'error': 'Archivo vacío'}), 400
-
-    # Abrir con Pillow y normalizar orientación
-    try:
-        img = Image.open(io.BytesIO(original_bytes))
-        img = ImageOps.exif_transpose(img)
-        # Convertimos a RGB para evitar problemas de modo (p.ej. PNG con alpha → lo podés mantener si querés)
-        if img.mode not in ('RGB', 'RGBA'):
-            img = img.convert('RGB')
-    except Exception as e:
-        return jsonify({'error': f'No se pudo leer la imagen: {str(e)}'}), 400
-
-    # Resize "thumbnail" mantiene aspect ratio
-    img.thumbnail((max_size, max_size))
-
-    # Serializar optimizada a bytes en memoria
-    out = io.BytesIO()
-    if target_format == 'jpeg':
-        # JPEG progresivo
-        img = img.convert('RGB')
-        img.save(out, format='JPEG', quality=82, optimize=True, progressive=True)
-        mime = 'image/jpeg'
+    source_digest = hashlib.sha256(original_bytes).hexdigest()
+
+    # Deduplicación por archivo subido: la misma foto no se vuelve a procesar ni guardar
+    db_image, src = _find_duplicate(source_digest, product_id)
+    if not db_image and src:
+        # otro producto (o imagen suelta): nueva fila que referencia el mismo contenido, sin bytes
+        db_image = _reference_image(src, product_id, source_digest)
+    pending = False
+    if db_image:
+        # mismo producto: reutilizamos la fila (misma URL, cache del navegador caliente);
+        # si no, la referencia nueva de arriba
+        deduplicated = True
     else:
-        # WEBP (recomendado: más liviano, soporte general actual)
-        # Si hay alpha y querés preservarla:
-        if img.mode == 'RGBA':
-            img.save(out, format='WEBP', quality=80, method=6, lossless=False)
-        else:
-            img.save(out, format='WEBP', quality=80, method=6)
-        mime = 'image/webp'
-
-    optimized_bytes = out.getvalue()
-    width, height = img.size
-
-    # Digest para ETag/caché y deduplicación opcional
-    digest = hashlib.sha256(optimized_bytes).hexdigest()
-
-    # Guardar en BD
-    db_image = ProductImage(
-        product_id=product_id,
-        mime_type=mime,
-        bytes=optimized_bytes,
-        width=width,
-        height=height,
-        digest=digest,
-        created_at=now_cba_naive(),
-    )
+        # Solo la cabecera (barato): el decode/encode con Pillow va al pool
+        try:
+            mime, width, height = probe_image(original_bytes)
+        except Exception as e:
+            return jsonify({'error': f'No se pudo leer la imagen: {str(e)}'}), 400
+
+        # Mientras se procesa, se sirve el original (guardado en el store por su digest)
+        db_image = ProductImage(
+            product_id=product_id,
+            source_digest=source_digest,
+            status='pending',
+            created_at=now_cba_naive(),
+            queued_at=now_cba_naive(),
+            **store_rendition({
+                'mime_type': mime,
+                'bytes': original_bytes,
+                'width': width,
+                'height': height,
+                'digest': source_digest,
+            }),
+        )
+        deduplicated = False
+        pending = True
     db.session.add(db_image)
     db.session.commit()
 
@@ -341,12 +397,134 @@ def upload_image():
     if product_id:
         product = Product.query.get(product_id)
         if product:
-            set_as_main = (request.form.get('as_main') in ('1', 'true', 'yes')) or not product.image_url
-            if set_as_main:
-                product.image_url = img_url
+            _set_main_image(product, img_url, request.form.get('as_main') in ('1', 'true', 'yes'))
             db.session.commit()
 
-    return jsonify({'url': img_url, 'image_id': db_image.id}), 201
+    catalog_cache.invalidate()
+
+    if pending:
+        # con IMAGE_PROCESSING=sync ya vuelve terminada ('ready' o 'failed')
+        status = image_jobs.submit_upload(db_image.id, original_bytes, target_format, max_size)
+        return jsonify({'url': img_url, 'image_id': db_image.id, 'status': status,
+                        'deduplicated': False}), 202 if status == 'pending' else 201
+
+    return jsonify({'url': img_url, 'image_id': db_image.id, 'status': db_image.status,
+                    'deduplicated': deduplicated}), 201
+
+
+@admin_bp.route('/upload/bulk', methods=['POST'])
+@jwt_required()
+def upload_images_bulk():
+    """
+    Carga masiva: muchas imágenes en un solo request.
+    Campos aceptados (form-data):
+      - images: archivos (repetir el campo)
+      - product_id (opcional): uno por archivo, en el mismo orden; si viene uno solo aplica a todos
+      - as_main (opcional): uno por archivo ('1'/'0'), en el mismo orden
+      - format / max_size: igual que /upload, para todo el lote
+    Los archivos se procesan en paralelo en el pool de imágenes y todas las filas
+    se insertan en una sola transacción. Respuesta: {'images': [{url, image_id, deduplicated}, ...]}
+    """
+    if not admin_required():
+        return jsonify({'error': 'Acceso denegado.'}), 403
+
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({'error': 'Falta el campo "images"'}), 400
+
+    target_format = (request.form.get('format') or 'webp').lower()
+    max_size = int(request.form.get('max_size') or 1600)
+    raw_pids = request.form.getlist('product_id')
+    raw_mains = request.form.getlist('as_main')
+
+    entries = []
+    for i, file in enumerate(files):
+        raw_pid = raw_pids[i] if i < len(raw_pids) else (raw_pids[0] if len(raw_pids) == 1 else '')
+        original_bytes = file.read()
+        if not original_bytes:
+            return jsonify({'error': f'Archivo vacío: {file.filename}'}), 400
+        try:
+            probe_image(original_bytes)  # solo cabecera: rechazamos el lote antes de procesar
+        except Exception as e:
+            return jsonify({'error': f'No se pudo leer la imagen {file.filename}: {str(e)}'}), 400
+        entries.append({
+            'bytes': original_bytes,
+            'source_digest': hashlib.sha256(original_bytes).hexdigest(),
+            'product_id': int(raw_pid) if raw_pid.isdigit() else None,
+            'as_main': (raw_mains[i] if i < len(raw_mains) else '') in ('1', 'true', 'yes'),
+        })
+
+    # Archivos únicos que no existen todavía -> se codifican en paralelo (una vez cada uno)
+    to_encode = {}
+    for e in entries:
+        e['reuse'], e['src'] = _find_duplicate(e['source_digest'], e['product_id'])
+        if not (e['reuse'] or e['src']):
+            to_encode.setdefault(e['source_digest'], e['bytes'])
+
+    digests = list(to_encode)
+    try:
+        results = image_jobs.map(
+            partial(process_upload, target_format=target_format, max_size=max_size),
+            [to_encode[d] for d in digests],
+        )
+    except Exception as e:
+        return jsonify({'error': f'Error procesando imágenes: {str(e)}'}), 500
+    encoded = dict(zip(digests, results))
+
+    stored = []
+    try:
+        created = {}   # source_digest -> fila nueva de este lote (para referenciarla)
+        for e in entries:
+            ref = None
+            if not e['reuse']:
+                # mismo archivo en otra fila, o repetido dentro del lote
+                src = e['src'] or created.get(e['source_digest'])
+                ref = _reference_image(src, e['product_id'], e['source_digest']) if src else None
+            if e['reuse']:
+                e['image'], e['deduplicated'] = e['reuse'], True
+            elif ref is not None:
+                e['image'], e['deduplicated'] = ref, True
+            else:
+                if e['source_digest'] not in encoded:
+                    # el origen se borró después de _find_duplicate: se codifica acá
+                    encoded[e['source_digest']] = process_upload(
+                        e['bytes'], target_format=target_format, max_size=max_size)
+                main, variants = encoded[e['source_digest']]
+                db_image = ProductImage(
+                    product_id=e['product_id'],
+                    source_digest=e['source_digest'],
+                    created_at=now_cba_naive(),
+                    **store_rendition(main),
+                )
+                db_image.variants = [ProductImageVariant(**store_rendition(v)) for v in variants]
+                stored += [main['digest']] + [v['digest'] for v in variants]
+                created[e['source_digest']] = db_image
+                e['image'], e['deduplicated'] = db_image, False
+            db.session.add(e['image'])
+        db.session.flush()  # ids para armar las URLs
+
+        products = {
+            p.id: p for p in Product.query.filter(
+                Product.id.in_(list({e['product_id'] for e in entries if e['product_id']}))
+            )
+        }
+        for e in entries:
+            e['url'] = url_for('public.serve_image', image_id=e['image'].id)
+            product = products.get(e['product_id'])
+            if product:
+                _set_main_image(product, e['url'], e['as_main'])
+
+        db.session.commit()
+    except Exception as ex:
+        db.session.rollback()
+        release_blobs(stored)  # archivos escritos para filas que no llegaron a guardarse
+        return jsonify({'error': f'Error guardando imágenes: {str(ex)}'}), 500
+
+    catalog_cache.invalidate()
+    return jsonify({'images': [
+        {'url': e['url'], 'image_id': e['image'].id, 'deduplicated': e['deduplicated']}
+        for e in entries
+    ]}), 201
 
 
 # --- NUEVO: asociar imágenes huérfanas a un producto ---
@@ -383,6 +561,7 @@ def attach_images(product_id):
         except Exception:
             db.session.rollback()
 
+    catalog_cache.invalidate()
     return jsonify({
         'message': f'{len(imgs)} imágenes asociadas al producto {product_id}.',
         'attached_ids': [im.id for im in imgs],
@@ -403,9 +582,13 @@ def delete_image(image_id):
 
     # Guardamos el product_id antes de borrar para poder ajustar principal
     pid = img.product_id
+    # y los digests (principal + variantes) para limpiar el store de archivos
+    digests = image_digests([image_id])
+    hand_over_blobs([image_id])
 
     db.session.delete(img)
     db.session.commit()
+    release_blobs(digests)
 
     # Si estaba asociada a un producto y la principal del producto apuntaba a esta imagen,
     # reasignar principal a otra imagen del mismo producto (si existe), o dejar None.
@@ -421,4 +604,18 @@ def delete_image(image_id):
                 product.image_url = f"/public/img/{next_img.id}" if next_img else None
                 db.session.commit()
 
+    catalog_cache.invalidate()
     return jsonify({'message': f'Imagen {image_id} eliminada'}), 200
+
+
+# =======================
+#       MÉTRICAS
+# =======================
+
+@admin_bp.route('/metrics/mercadopago', methods=['GET'])
+@jwt_required()
+def mercadopago_metrics():
+    """Latencia de las llamadas a la API de MercadoPago por endpoint (este worker)."""
+    if not admin_required():
+        return jsonify({'error': 'Acceso denegado.'}), 403
+    return jsonify({'pid': os.getpid(), 'endpoints': mp_metrics.snapshot()}), 200
@@ -1,16 +1,17 @@
 # backend/app/routes/mercadopago_bp.py
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request, jwt_required
-import mercadopago
 import os
-from datetime import datetime
-from ..models import Order, OrderItem, Product, User
-from ..database import db
+from datetime import datetime, timedelta
+from ..models import CartItem, Order, OrderItem, Product, ProductFlavor, User, AR_TZ
+from .. import db
+from .. import catalog_cache, payment_lookup
+from ..reservations import hold_stock, release_reservation, convert_reservation, take_converted
+from ..stock import lock_stock
+from ..webhook_inbox import enqueue_payment
+from ..mp_client import get_sdk
+from ..email_outbox import queue_email
 from flask import current_app
-# ==== Helpers de Email (SMTP directo, sin Flask-Mail) ====
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 
 def format_currency_ars(n):
     try:
@@ -97,52 +98,6 @@ def build_order_email_html(order_id, customer_name, customer_email, items, total
     return html
 
 
-def send_email_smtp(to_email, subject, html):
-    import email.charset
-    from email.mime.multipart import MIMEMultipart
-    from email.mime.text import MIMEText
-    from email.header import Header
-    from email.utils import formataddr
-
-    host = os.getenv("MAIL_SERVER", "smtp.gmail.com")
-    port = int(os.getenv("MAIL_PORT", "587"))
-    use_tls = str(os.getenv("MAIL_USE_TLS", "True")).lower() == "true"
-    username = os.getenv("MAIL_USERNAME")
-    password = os.getenv("MAIL_PASSWORD")
-    default_sender = os.getenv("MAIL_DEFAULT_SENDER") or username
-
-    if not (username and password):
-        print("⚠️ Email no enviado: faltan MAIL_USERNAME/MAIL_PASSWORD")
-        return False
-
-    # 👇 Forzamos charset UTF-8 en todo el mensaje
-    email.charset.add_charset('utf-8', email.charset.SHORTEST, None, 'utf-8')
-
-    msg = MIMEMultipart("alternative")
-    msg.set_charset("utf-8")
-
-    # Cabeceras en UTF-8
-    msg["Subject"] = str(Header(subject, "utf-8"))
-    msg["From"] = str(Header(default_sender, "utf-8"))
-    msg["To"] = str(Header(to_email, "utf-8"))
-
-    # Cuerpo HTML en UTF-8
-    msg.attach(MIMEText(html, "html", "utf-8"))
-
-    try:
-        server = smtplib.SMTP(host, port)
-        if use_tls:
-            server.starttls()
-        server.login(username, password)
-        # 🔥 CAMBIO: usar as_bytes().decode('utf-8') en lugar de as_string()
-        server.sendmail(default_sender, [to_email], msg.as_bytes())
-        server.quit()
-        print(f"✅ Email enviado a {to_email}")
-        return True
-    except Exception as e:
-        print(f"❌ Error enviando email a {to_email}: {e}")
-        return False
-
 mercadopago_bp = Blueprint('mercadopago', __name__)
 
 
@@ -175,8 +130,9 @@ def get_mp_creds():
 
 
 def get_mp_sdk():
+    # un SDK por proceso con conexiones keep-alive, timeouts y reintentos (app/mp_client.py)
     at, _ = get_mp_creds()
-    return mercadopago.SDK(at)
+    return get_sdk(at, current_app.config)
 
 
 # =========================================================
@@ -184,6 +140,85 @@ def get_mp_sdk():
 # =========================================================
 # =========================================================
 
+def _resolve_checkout_items(raw_items):
+    """
+    Valida el carrito contra la BD en UNA query (product LEFT JOIN product_flavors
+    de los sabores pedidos). Lo que manda el cliente solo aporta id, cantidad y sabor.
+    -> (líneas, None) | (None, respuesta de error)
+    líneas: [{product_id, title, unit_price, quantity, flavor, flavor_stock_mode}]
+    """
+    requested = []
+    for it in raw_items:
+        prod_id = str(it.get('id') or '')
+        if not prod_id.isdigit():
+            return None, (jsonify({'error': f'Producto inválido: {prod_id or "sin id"}'}), 400)
+        try:
+            qty = int(it.get('quantity', 1) or 1)
+        except (TypeError, ValueError):
+            qty = 0
+        if qty <= 0:
+            return None, (jsonify({'error': 'quantity debe ser > 0'}), 400)
+        requested.append((int(prod_id), (it.get('selected_flavor') or '').strip() or None, qty))
+
+    ids = {pid for pid, _, _ in requested}
+    flavor_names = {flavor for _, flavor, _ in requested if flavor}
+    rows = (
+        db.session.query(
+            Product.id, Product.name, Product.price, Product.stock, Product.is_active,
+            Product.flavors, Product.flavor_stock_mode,
+            ProductFlavor.name.label('flavor_name'),
+            ProductFlavor.active.label('flavor_active'),
+            ProductFlavor.stock.label('flavor_stock'),
+        )
+        .outerjoin(ProductFlavor, db.and_(
+            ProductFlavor.product_id == Product.id,
+            ProductFlavor.name.in_(list(flavor_names)),
+        ))
+        .filter(Product.id.in_(ids))
+        .all()
+    )
+    products, flavors = {}, {}
+    for r in rows:
+        products[r.id] = r
+        if r.flavor_name is not None:
+            flavors[(r.id, r.flavor_name)] = r
+
+    unavailable = []
+    totals = {}
+    for pid, flavor, qty in requested:
+        product = products.get(pid)
+        if product is None or not product.is_active or float(product.price or 0) <= 0:
+            unavailable.append({'product_id': pid, 'reason': 'Producto no disponible'})
+            continue
+        totals[pid] = totals.get(pid, 0) + qty
+        if flavor:
+            entry = flavors.get((pid, flavor))
+            ok, _ = CartItem._flavor_status(
+                flavor, qty,
+                entry.flavor_active if entry else None,
+                entry.flavor_stock if entry else None,
+                product.flavors, product.flavor_stock_mode,
+            )
+            if not ok:
+                unavailable.append({'product_id': pid, 'flavor': flavor, 'reason': 'Sabor no disponible'})
+    # chequeo rápido de stock total; el descuento atómico (hold_stock) es el que manda
+    for pid, qty in totals.items():
+        if int(products[pid].stock or 0) < qty:
+            unavailable.append({'product_id': pid, 'reason': 'Stock insuficiente'})
+    if unavailable:
+        return None, (jsonify({'error': 'Hay productos no disponibles en el carrito', 'unavailable': unavailable}), 409)
+
+    lines = [{
+        'product_id': pid,
+        'title': products[pid].name,
+        'unit_price': float(products[pid].price),
+        'quantity': qty,
+        'flavor': flavor,
+        'flavor_stock_mode': bool(products[pid].flavor_stock_mode),
+    } for pid, flavor, qty in requested]
+    return lines, None
+
+
 @mercadopago_bp.route('/create-preference', methods=['POST'])
 def create_preference():
     """Crear preferencia de pago en MercadoPago (JWT opcional) con sabor elegido"""
@@ -204,29 +239,35 @@ def create_preference():
         if not (data.get('payer') and data['payer'].get('email')):
             return jsonify({'error': 'Email del payer es requerido'}), 400
 
-        # Normalizar items
+        # Precio, título y sabores salen de la BD (una sola query), no del navegador
+        lines, error = _resolve_checkout_items(data['items'])
+        if error:
+            return error
+
         items = []
         flavors_meta = []   # 👈 guardaremos acá los sabores para metadata
-        for it in data['items']:
-            qty = int(it.get('quantity', 1) or 1)
-            price = float(it.get('unit_price', 0) or 0)
-            if price <= 0:
-                return jsonify({'error': 'unit_price debe ser > 0'}), 400
-
+        for line in lines:
             items.append({
-                "id": str(it.get("id") or "item"),
-                "title": str(it["title"]),
-                "quantity": qty,
-                "unit_price": price,
+                "id": str(line['product_id']),
+                "title": line['title'],
+                "quantity": line['quantity'],
+                "unit_price": line['unit_price'],
                 "currency_id": "ARS",
             })
-
-            if it.get("selected_flavor"):
+            if line['flavor']:
                 flavors_meta.append({
-                    "product_id": str(it.get("id")),
-                    "flavor": it["selected_flavor"]
+                    "product_id": str(line['product_id']),
+                    "flavor": line['flavor']
                 })
 
+        # Apartar stock mientras el comprador paga (vence solo si no se paga)
+        hold_lines = [(line['product_id'], line['flavor'], line['quantity']) for line in lines]
+        hold_minutes = current_app.config.get('STOCK_HOLD_MINUTES', 15)
+        flavor_mode = {line['product_id']: line['flavor_stock_mode'] for line in lines}
+        reservation_ref, missing = hold_stock(hold_lines, hold_minutes, flavor_mode=flavor_mode)
+        if missing:
+            return jsonify({'error': 'Stock insuficiente para uno o más productos', 'missing': missing}), 409
+
         frontend_url   = os.getenv('FRONTEND_URL', 'http://localhost:5173').rstrip('/')
         backend_public = os.getenv('BACKEND_PUBLIC_URL', '').rstrip('/')
         is_local = ("localhost" in frontend_url) or ("127.0.0.1" in frontend_url)
@@ -265,7 +306,8 @@ def create_preference():
                 "form_email": form_email,
                 "name": payer_in.get("name", ""),
                 "surname": payer_in.get("surname", ""),
-                "flavors": flavors_meta   # 👈 acá van los sabores
+                "flavors": flavors_meta,   # 👈 acá van los sabores
+                "reservation_ref": reservation_ref,
             },
             "back_urls": {
                 "success": f"{frontend_url}/thank-you?status=approved",
@@ -274,20 +316,32 @@ def create_preference():
             }
         }
 
+        if reservation_ref:
+            # que no se pueda pagar con la reserva ya vencida
+            expires = datetime.now(AR_TZ) + timedelta(minutes=hold_minutes)
+            preference_data["expires"] = True
+            preference_data["expiration_date_to"] = expires.isoformat(timespec='milliseconds')
+
         if not is_local:
             preference_data["auto_return"] = "approved"
         if backend_public:
             preference_data["notification_url"] = f"{backend_public}/api/mercadopago/webhook"
 
         sdk = get_mp_sdk()
-        pref = sdk.preference().create(preference_data)
+        try:
+            pref = sdk.preference().create(preference_data)
+        except Exception:
+            release_reservation(reservation_ref)
+            raise
         if pref.get("status") == 201:
             return jsonify({
                 'preference_id': pref['response']['id'],
                 'init_point': pref['response']['init_point'],
-                'sandbox_init_point': pref['response'].get('sandbox_init_point')
+                'sandbox_init_point': pref['response'].get('sandbox_init_point'),
+                'reservation_expires_in': hold_minutes * 60 if reservation_ref else None,
             }), 201
 
+        release_reservation(reservation_ref)
         return jsonify({'error': 'Error creando preferencia en MercadoPago'}), 400
 
     except Exception as e:
@@ -302,10 +356,14 @@ def create_preference():
 # =========================================================
 @mercadopago_bp.route('/webhook', methods=['POST', 'GET'])
 def webhook():
-    """Webhook para notificaciones de MercadoPago"""
+    """
+    Webhook para notificaciones de MercadoPago.
+    Solo encola el pago (app/webhook_inbox.py) y responde 200 enseguida: la consulta
+    a MP, la orden y el email los procesa el worker, con reintentos.
+    """
     try:
         # MP puede enviar data por query params o JSON body
-        data = request.get_json() or {}
+        data = request.get_json(silent=True) or {}
         payment_id = data.get('data', {}).get('id') or request.args.get('data.id') or request.args.get('id')
         notification_type = data.get('type') or request.args.get('type') or request.args.get('topic')
         
@@ -316,20 +374,8 @@ def webhook():
 
         # Solo procesar tipo 'payment'
         if notification_type == 'payment' and payment_id:
-            print(f"💳 Consultando pago {payment_id}...")
-            
-            sdk = get_mp_sdk()
-            payment_response = sdk.payment().get(payment_id)
-            
-            if payment_response.get("status") == 200:
-                payment = payment_response.get("response")
-                print(f"✅ Pago obtenido: Status={payment.get('status')}")
-                
-                if payment.get('status') == 'approved':
-                    # 🔥 SOLUCIÓN: Ejecutar en background sin app_context
-                    create_order_from_payment(payment)
-            else:
-                print(f"❌ Error consultando pago: {payment_response}")
+            enqueue_payment(payment_id, notification_type)
+            print(f"📬 Pago {payment_id} encolado")
         else:
             print(f"⚠️ Webhook ignorado (type={notification_type})")
 
@@ -340,6 +386,34 @@ def webhook():
         print(f"💥 ERROR EN WEBHOOK: {str(e)}\n{traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
+
+def fetch_payment(payment_id):
+    """sdk.payment().get con cache corto y una sola llamada por pago a la vez (app/payment_lookup.py)."""
+    return payment_lookup.get(payment_id, lambda: get_mp_sdk().payment().get(payment_id))
+
+
+def process_payment_notification(payment_id):
+    """
+    Lo llama el worker de la bandeja de webhooks. Lanza excepción para reintentar.
+    Idempotente: si la orden ya existe no consulta a MP.
+    """
+    if Order.query.filter_by(payment_id=str(payment_id)).first():
+        print(f"⚠️ Orden ya creada para payment_id={payment_id}, nada que hacer.")
+        return
+
+    print(f"💳 Consultando pago {payment_id}...")
+    payment_response = fetch_payment(payment_id)
+
+    if payment_response.get("status") != 200:
+        raise RuntimeError(f"Error consultando pago {payment_id}: {payment_response}")
+
+    payment = payment_response.get("response")
+    print(f"✅ Pago obtenido: Status={payment.get('status')}")
+
+    if payment.get('status') == 'approved':
+        create_order_from_payment(payment)
+
+
 @mercadopago_bp.route('/auto-login/<payment_id>', methods=['POST'])
 def auto_login_by_payment(payment_id):
     """Auto-login temporal después de pago exitoso"""
@@ -392,18 +466,14 @@ def create_order_from_payment(payment_data):
     Crear orden + items, descontar stock (general y por sabor) y enviar email.
     Maneja múltiples sabores para un mismo producto.
     """
-    from sqlalchemy.orm import sessionmaker
-    from sqlalchemy import create_engine
     from sqlalchemy.exc import IntegrityError
-    import json
-    from sqlalchemy.orm.attributes import flag_modified
+    from sqlalchemy import update, func
 
     print("=== [DEBUG] INICIO create_order_from_payment ===")
     print("Payment data recibido:", payment_data)
 
-    engine = create_engine(os.getenv('SQLALCHEMY_DATABASE_URI'))
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    # Sesión de la app (engine y pool compartidos); corre en el app context del worker de webhooks
+    session = db.session
 
     try:
         pid = str(payment_data.get('id'))
@@ -478,6 +548,18 @@ def create_order_from_payment(payment_data):
         raw_items = (payment_data.get("additional_info") or {}).get("items") or []
         print("[DEBUG] raw_items recibidos:", raw_items)
 
+        # Si el stock quedó apartado en create_preference, la reserva se convierte y no se descuenta de nuevo
+        # (solo las líneas todavía apartadas: el sweeper pudo haber vencido parte de la reserva)
+        reserved = convert_reservation(meta.get('reservation_ref'), session)
+        print(f"[DEBUG] Reserva {meta.get('reservation_ref')}: {reserved or 'sin reserva vigente'}")
+
+        # Mismo orden de bloqueo que app/stock.py (productos y después sabores): sin deadlocks
+        stock_lines = [
+            (int(it["id"]), it.get("selected_flavor") or (flavors_list[idx] if idx < len(flavors_list) else None))
+            for idx, it in enumerate(raw_items) if str(it.get("id", "")).isdigit()
+        ]
+        lock_stock({pid for pid, _ in stock_lines}, {(pid, f) for pid, f in stock_lines if f})
+
         items_for_email = []
         for idx, it in enumerate(raw_items):
             print("[DEBUG] Procesando item:", it)
@@ -501,23 +583,27 @@ def create_order_from_payment(payment_data):
                 selected_flavor=selected_flavor
             ))
 
-            product = session.query(Product).get(int(prod_id))
-            if product:
-                old_stock = product.stock or 0
-                product.stock = max(0, old_stock - qty)
-                print(f"[DEBUG] Stock general prod {prod_id}: {old_stock} -> {product.stock}")
-
-                if selected_flavor and product.flavor_catalog:
-                    catalog = json.loads(json.dumps(product.flavor_catalog or []))
-                    for flavor in catalog:
-                        if flavor.get("name") == selected_flavor:
-                            old_fstock = flavor.get("stock") or 0
-                            flavor["stock"] = max(0, old_fstock - qty)
-                            print(f"[DEBUG] Stock sabor '{selected_flavor}': {old_fstock} -> {flavor['stock']}")
-                            break
-                    product.flavor_catalog = catalog
-                    flag_modified(product, "flavor_catalog")
-                    session.add(product)
+            # Descuentos atómicos en la BD (sin leer-modificar-escribir): el pago ya está
+            # aprobado, así que no se rechaza, solo se evita bajar de 0.
+            # Lo que seguía apartado en la reserva convertida ya se descontó al apartar.
+            to_take = take_converted(reserved, int(prod_id), selected_flavor, qty)
+            if to_take:
+                new_stock = session.execute(
+                    update(Product)
+                    .where(Product.id == int(prod_id))
+                    .values(stock=func.greatest(Product.stock - to_take, 0))
+                    .returning(Product.stock)
+                ).scalar()
+                print(f"[DEBUG] Stock general prod {prod_id}: -{to_take} -> {new_stock}")
+
+                if selected_flavor:
+                    new_fstock = session.execute(
+                        update(ProductFlavor)
+                        .where(ProductFlavor.product_id == int(prod_id), ProductFlavor.name == selected_flavor)
+                        .values(stock=func.greatest(ProductFlavor.stock - to_take, 0))
+                        .returning(ProductFlavor.stock)
+                    ).scalar()
+                    print(f"[DEBUG] Stock sabor '{selected_flavor}': -{to_take} -> {new_fstock}")
 
             title = it.get("title", f"Producto {prod_id}")
             if selected_flavor:
@@ -529,16 +615,9 @@ def create_order_from_payment(payment_data):
                 "subtotal": subtotal
             })
 
-        try:
-            session.commit()
-            print(f"[DEBUG] Commit OK para order_id={order.id}")
-        except IntegrityError:
-            session.rollback()
-            print(f"⚠️ Pedido duplicado detectado en commit (payment_id={pid}), ignorando.")
-            return
-
-        # Email
-        try:
+        # Email de confirmación: va a la bandeja en la misma transacción que la orden
+        # (lo manda app/email_outbox.py; si la orden no se guarda, tampoco el email)
+        if email_to_use:
             html = build_order_email_html(
                 order_id=order.id,
                 customer_name=full_name,
@@ -548,20 +627,27 @@ def create_order_from_payment(payment_data):
                 created_at_iso=order.created_at.isoformat(),
                 shipping_address_text=order.shipping_address
             )
-            send_email_smtp(
+            queue_email(
                 email_to_use,
                 f"Zarpados Vapers - Confirmación de compra #{order.id}",
-                html
+                html,
+                commit=False
             )
-            print("[DEBUG] Email enviado OK")
-        except Exception as e:
-            print(f"⚠️ No se pudo enviar email: {e}")
+
+        try:
+            session.commit()
+            catalog_cache.invalidate()  # cambió el stock
+            print(f"[DEBUG] Commit OK para order_id={order.id}")
+        except IntegrityError:
+            session.rollback()
+            print(f"⚠️ Pedido duplicado detectado en commit (payment_id={pid}), ignorando.")
+            return
 
     except Exception as e:
         session.rollback()
         print(f"💥 Error en create_order_from_payment: {e}")
+        raise  # la bandeja de webhooks reintenta con backoff
     finally:
-        session.close()
         print("=== [DEBUG] FIN create_order_from_payment ===")
 
 
@@ -573,8 +659,7 @@ def create_order_from_payment(payment_data):
 def get_payment(payment_id):
     """Obtener información de un pago específico"""
     try:
-        sdk = get_mp_sdk()
-        payment_response = sdk.payment().get(payment_id)
+        payment_response = fetch_payment(payment_id)
 
         if payment_response.get("status") == 200:
             return jsonify(payment_response["response"]), 200
@@ -1,10 +1,19 @@
-from flask import Blueprint, jsonify, request,abort, make_response
-from app import db
+from flask import Blueprint, jsonify, request,abort
+from app import db, catalog_cache
 from app.models import Product, Category
 import os
-from flask import send_from_directory, current_app
-from app.models import ProductImage
+from flask import send_from_directory, send_file, current_app
+from app.models import ProductImage, ProductImageVariant
+from app.image_storage import get_image_storage
+from app.search import search_filter, search_rank
+from app.suggest import suggest_index
+from app.facets import parse_facet_filters, all_criteria, facet_counts
+from sqlalchemy import tuple_
+from sqlalchemy.orm import load_only
+from datetime import datetime
+import base64
 import hashlib
+import json
 
 
 
@@ -24,75 +33,343 @@ def about():
 
 # === RUTAS PÚBLICAS PARA LA TIENDA DE VAPES ===
 
+# === Paginación por cursor (keyset) y campos reducidos para /products ===
+PRODUCTS_PAGE_MAX = 100
+# columnas del listado (grilla de la tienda): sin description ni catálogo de sabores
+LISTING_FIELDS = ('id', 'name', 'price', 'image_url', 'stock', 'brand')
+SERIALIZABLE_FIELDS = LISTING_FIELDS + (
+    'short_description', 'category_id', 'is_active', 'flavors', 'flavor_enabled',
+    'puffs', 'nicotine_mg', 'volume_ml', 'created_at',
+)
+# sort -> (columna, descendente)
+PRODUCT_SORTS = {
+    'newest': (Product.created_at, True),
+    'price_asc': (Product.price, False),
+    'price_desc': (Product.price, True),
+}
+
+
+def _encode_cursor(sort_value, product_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, product_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_cursor(cursor, sort):
+    """Devuelve (valor_de_orden, id) o lanza ValueError si el cursor es inválido."""
+    try:
+        sort_value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if sort == 'newest':
+            sort_value = datetime.fromisoformat(sort_value)
+        else:
+            sort_value = float(sort_value)
+        return sort_value, int(product_id)
+    except Exception:
+        raise ValueError('cursor inválido')
+
+
+def _parse_fields(raw):
+    """fields=listing | fields=id,name,price  -> tupla de columnas (None = todo)."""
+    if not raw:
+        return None
+    if raw == 'listing':
+        return LISTING_FIELDS
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in SERIALIZABLE_FIELDS]
+    if unknown:
+        raise ValueError(f"Campos no soportados: {', '.join(unknown)}")
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return tuple(fields)
+
+
+def _serialize_fields(product, fields):
+    out = {}
+    for f in fields:
+        value = getattr(product, f)
+        if f == 'price':
+            value = float(value or 0)
+        elif f == 'stock':
+            value = int(value or 0)
+        elif f == 'flavors':
+            value = value or []
+        elif f == 'created_at' and value is not None:
+            value = value.isoformat()
+        out[f] = value
+    return out
+
+
+def _catalog_etag(key):
+    # versión del catálogo + hash de los parámetros: no hace falta serializar nada
+    key_hash = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+    return f"{catalog_cache.version}-{key_hash}"
+
+
+def _cached_json(key, loader):
+    """
+    Respuesta JSON servida desde catalog_cache, con ETag / If-None-Match.
+    `loader()` devuelve (payload, status); se cachea el JSON ya serializado.
+    Si el cliente ya tiene la versión actual responde 304 sin tocar la BD.
+    """
+    etag = _catalog_etag(key)
+    if request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+
+    def build():
+        payload, status = loader()
+        return current_app.json.dumps(payload), status
+
+    body, status = catalog_cache.get_or_set(key, build)
+    resp = current_app.response_class(body, status=status, mimetype='application/json')
+    if status == 200:
+        resp.set_etag(etag)
+        # el navegador guarda la respuesta pero revalida siempre (barato: 304)
+        resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+def _base_criteria(category_id, search):
+    criteria = [Product.is_active == True]
+    # Filtrar por categoría si se especifica
+    if category_id:
+        criteria.append(Product.category_id == category_id)
+    # Filtrar por búsqueda si se especifica (full-text: nombre, marca, sabores, descripción corta)
+    criterion = search_filter(search)
+    if criterion is not None:
+        criteria.append(criterion)
+    return criteria
+
+
+def _load_products(args):
+    """Arma el payload de /products. Lanza ValueError ante parámetros inválidos (400)."""
+    # Parámetros opcionales de filtrado
+    category_id = args.get('category_id', type=int)
+    search = args.get('search', '')
+    sort = args.get('sort', 'newest')
+    limit = args.get('limit', type=int)
+    cursor = args.get('cursor')
+
+    if sort not in PRODUCT_SORTS:
+        raise ValueError(f"sort inválido, usar: {', '.join(PRODUCT_SORTS)}")
+    fields = _parse_fields(args.get('fields'))
+
+    # Query base: activo + categoría + búsqueda + facetas (marca, caladas, nicotina, ...)
+    query = Product.query.filter(
+        *_base_criteria(category_id, search),
+        *all_criteria(parse_facet_filters(args)),
+    )
+
+    sort_col, descending = PRODUCT_SORTS[sort]
+
+    # Solo leer las columnas pedidas (evita traer description de 40000 chars);
+    # la columna de orden se carga siempre para armar el cursor
+    if fields:
+        columns = set(fields) | {sort_col.key}
+        query = query.options(load_only(*[getattr(Product, c) for c in columns]))
+
+    if descending:
+        query = query.order_by(sort_col.desc(), Product.id.desc())
+    else:
+        query = query.order_by(sort_col.asc(), Product.id.asc())
+
+    paginated = limit is not None or cursor is not None
+    if cursor:
+        after_value, after_id = _decode_cursor(cursor, sort)
+        if descending:
+            query = query.filter(tuple_(sort_col, Product.id) < tuple_(after_value, after_id))
+        else:
+            query = query.filter(tuple_(sort_col, Product.id) > tuple_(after_value, after_id))
+
+    if paginated:
+        limit = max(1, min(limit or PRODUCTS_PAGE_MAX, PRODUCTS_PAGE_MAX))
+        # pedimos uno más para saber si hay página siguiente
+        products = query.limit(limit + 1).all()
+        has_more = len(products) > limit
+        products = products[:limit]
+    else:
+        products = query.all()
+
+    if fields:
+        items = [_serialize_fields(p, fields) for p in products]
+    else:
+        items = Product.serialize_many(products)
+
+    if not paginated:
+        return items, 200
+
+    next_cursor = None
+    if has_more and products:
+        last = products[-1]
+        next_cursor = _encode_cursor(getattr(last, sort_col.key), last.id)
+    return {'items': items, 'next_cursor': next_cursor}, 200
+
+
 @public_bp.route('/products', methods=['GET'])
 def get_products():
-    """Obtener todos los productos activos"""
+    """
+    Obtener productos activos.
+    Sin `limit`/`cursor` responde la lista completa (compat con el front actual).
+    Parámetros opcionales:
+      - category_id, search: filtros
+      - brand, flavor, nicotine_mg, volume_ml: uno o varios (brand=A&brand=B o brand=A,B)
+      - puffs_min/puffs_max, price_min/price_max: rangos
+      - sort: 'newest' (default) | 'price_asc' | 'price_desc'
+      - limit: tamaño de página (máx. PRODUCTS_PAGE_MAX) -> responde {items, next_cursor}
+      - cursor: valor de next_cursor de la página anterior
+      - fields: 'listing' o lista separada por comas (id,name,price,...)
+    """
     try:
-        # Parámetros opcionales de filtrado
-        category_id = request.args.get('category_id', type=int)
-        search = request.args.get('search', '')
-        
-        # Query base
-        query = Product.query.filter(Product.is_active == True)
-        
-        # Filtrar por categoría si se especifica
-        if category_id:
-            query = query.filter(Product.category_id == category_id)
-        
-        # Filtrar por búsqueda si se especifica
-        if search:
-            query = query.filter(Product.name.ilike(f'%{search}%'))
-        
-        products = query.all()
-        return jsonify([product.serialize() for product in products]), 200
-        
+        args = request.args
+        key = ('products', tuple(sorted(args.items(multi=True))))
+        return _cached_json(key, lambda: _load_products(args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Error al obtener productos: ' + str(e)}), 500
 
+
+def _load_facets(args):
+    category_id = args.get('category_id', type=int)
+    criteria = _base_criteria(category_id, args.get('search', ''))
+    return facet_counts(criteria, parse_facet_filters(args)), 200
+
+
+@public_bp.route('/facets', methods=['GET'])
+def get_facets():
+    """
+    Conteos por faceta (marca, bandas de caladas, nicotina, volumen, sabor) y rango
+    de precios, con los mismos parámetros de filtro que /products.
+    Cada faceta ignora su propio filtro para poder elegir varios valores.
+    """
+    try:
+        args = request.args
+        key = ('facets', tuple(sorted(args.items(multi=True))))
+        return _cached_json(key, lambda: _load_facets(args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Error al obtener filtros: ' + str(e)}), 500
+
+
+SEARCH_LIMIT_MAX = 50
+
+
+def _load_search(q, limit, category_id):
+    criterion = search_filter(q)
+    if criterion is None:
+        return {'query': q, 'results': []}, 200
+
+    query = (
+        Product.query
+        .filter(Product.is_active == True, criterion)
+        .options(load_only(*[getattr(Product, f) for f in LISTING_FIELDS]))
+    )
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+
+    rank = search_rank(q)
+    ordering = [rank.desc()] if rank is not None else []
+    products = query.order_by(*ordering, Product.id.desc()).limit(limit).all()
+    return {
+        'query': q,
+        'results': [_serialize_fields(p, LISTING_FIELDS) for p in products],
+    }, 200
+
+
+@public_bp.route('/search', methods=['GET'])
+def search_products():
+    """
+    Búsqueda full-text ordenada por relevancia (sin acentos, por prefijo).
+    Parámetros: q (texto), limit (máx. SEARCH_LIMIT_MAX, default 20), category_id (opcional)
+    """
+    try:
+        q = (request.args.get('q') or '').strip()
+        limit = max(1, min(request.args.get('limit', 20, type=int), SEARCH_LIMIT_MAX))
+        category_id = request.args.get('category_id', type=int)
+        return _cached_json(('search', q.lower(), limit, category_id),
+                            lambda: _load_search(q, limit, category_id))
+    except Exception as e:
+        return jsonify({'error': 'Error al buscar productos: ' + str(e)}), 500
+
+
+@public_bp.route('/suggest', methods=['GET'])
+def suggest():
+    """
+    Autocompletado: nombres de producto, marcas y sabores que empiezan con `q`
+    (también por palabra, sin acentos). Se responde desde memoria, sin ir a la BD.
+    """
+    try:
+        q = request.args.get('q') or ''
+        limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+        suggest_index.refresh(catalog_cache.version)
+        return jsonify({'query': q, 'suggestions': suggest_index.suggest(q, limit)}), 200
+    except Exception as e:
+        return jsonify({'error': 'Error al obtener sugerencias: ' + str(e)}), 500
+
+
+def _load_product(product_id):
+    product = Product.query.filter(
+        Product.id == product_id,
+        Product.is_active == True
+    ).first()
+
+    if not product:
+        return {'error': 'Producto no encontrado'}, 404
+
+    return product.serialize(), 200
+
+
 @public_bp.route('/products/<int:product_id>', methods=['GET'])
 def get_product_by_id(product_id):
     """Obtener un producto específico por ID"""
     try:
-        product = Product.query.filter(
-            Product.id == product_id, 
-            Product.is_active == True
-        ).first()
-        
-        if not product:
-            return jsonify({'error': 'Producto no encontrado'}), 404
-            
-        return jsonify(product.serialize()), 200
+        return _cached_json(('product', product_id), lambda: _load_product(product_id))
         
     except Exception as e:
         return jsonify({'error': 'Error al obtener producto: ' + str(e)}), 500
 
+
+def _load_categories():
+    categories = Category.query.all()
+    return [category.serialize() for category in categories], 200
+
+
 @public_bp.route('/categories', methods=['GET'])
 def get_categories():
     """Obtener todas las categorías"""
     try:
-        categories = Category.query.all()
-        return jsonify([category.serialize() for category in categories]), 200
+        return _cached_json(('categories',), _load_categories)
         
     except Exception as e:
         return jsonify({'error': 'Error al obtener categorías: ' + str(e)}), 500
 
+
+def _load_category_products(category_id):
+    category = Category.query.get(category_id)
+    if not category:
+        return {'error': 'Categoría no encontrada'}, 404
+
+    products = Product.query.filter(
+        Product.category_id == category_id,
+        Product.is_active == True
+    ).all()
+
+    return {
+        'category': category.serialize(),
+        'products': Product.serialize_many(products)
+    }, 200
+
+
 @public_bp.route('/categories/<int:category_id>/products', methods=['GET'])
 def get_products_by_category(category_id):
     """Obtener productos de una categoría específica"""
     try:
-        category = Category.query.get(category_id)
-        if not category:
-            return jsonify({'error': 'Categoría no encontrada'}), 404
-            
-        products = Product.query.filter(
-            Product.category_id == category_id,
-            Product.is_active == True
-        ).all()
-        
-        return jsonify({
-            'category': category.serialize(),
-            'products': [product.serialize() for product in products]
-        }), 200
+        return _cached_json(('category_products', category_id),
+                            lambda: _load_category_products(category_id))
         
     except Exception as e:
         return jsonify({'error': 'Error al obtener productos de la categoría: ' + str(e)}), 500
@@ -136,18 +413,108 @@ def serve_upload(filename):
 
 
 
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'  # 1 año + immutable
+
+
+def _pick_variant(image_id, main, width, accepts_webp):
+    """
+    Elige entre la rendición principal y sus variantes la más chica que cubra
+    `width` (o la más grande si ninguna alcanza), en un formato que el cliente acepte.
+    Devuelve (modelo, id, digest, mime_type).
+    """
+    rows = (
+        db.session.query(
+            ProductImageVariant.id, ProductImageVariant.digest,
+            ProductImageVariant.mime_type, ProductImageVariant.width,
+        )
+        .filter(ProductImageVariant.image_id == image_id)
+        .all()
+    )
+    candidates = [(ProductImageVariant, r.id, r.digest, r.mime_type, r.width) for r in rows]
+    candidates.append((ProductImage, image_id, main.digest, main.mime_type, main.width or 0))
+
+    acceptable = [c for c in candidates if accepts_webp or c[3] != 'image/webp']
+    candidates = acceptable or candidates
+
+    # la principal primero ante empates (no duplica lecturas de variantes)
+    candidates.sort(key=lambda c: (c[4], c[0] is not ProductImage))
+    if width:
+        for c in candidates:
+            if c[4] >= width:
+                return c[:4]
+    return max(candidates, key=lambda c: (c[4], c[0] is ProductImage))[:4]
+
+
 @public_bp.route('/img/<int:image_id>')
 def serve_image(image_id: int):
-    img = ProductImage.query.get(image_id)
-    if not img or not img.bytes:
+    """
+    Sirve una imagen (store de archivos o BD, según dónde estén sus bytes).
+      - ?w=<px>: devuelve la variante más chica con ese ancho o más
+      - Accept: si el cliente no acepta image/webp se sirve la variante JPEG
+    """
+    # 1) Solo metadatos: si el cliente ya tiene la imagen no leemos el blob
+    meta = (
+        db.session.query(ProductImage.digest, ProductImage.mime_type, ProductImage.width,
+                         ProductImage.status)
+        .filter(ProductImage.id == image_id)
+        .first()
+    )
+    if not meta:
         abort(404)
 
-    # ETag basado en digest si existe, sino en hash de bytes
-    etag = img.digest or hashlib.sha256(img.bytes).hexdigest()
+    width = request.args.get('w', type=int)
+    accepts_webp = any(mt == 'image/webp' for mt, _ in request.accept_mimetypes)
+    negotiate = bool(width) or (meta.mime_type == 'image/webp' and not accepts_webp)
 
-    # Respuesta binaria con cabeceras de caché agresivas
-    resp = make_response(img.bytes)
-    resp.headers['Content-Type'] = img.mime_type or 'application/octet-stream'
-    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'  # 1 año + immutable
-    resp.headers['ETag'] = etag
-    return resp
+    model, row_id, etag, mime_type = ProductImage, image_id, meta.digest, meta.mime_type
+    if negotiate:
+        model, row_id, etag, mime_type = _pick_variant(image_id, meta, width, accepts_webp)
+
+    # Mientras el pool la procesa se sirve el original: que no quede cacheado para siempre
+    cache_control = IMAGE_CACHE_CONTROL if meta.status == 'ready' else 'no-cache'
+
+    if etag and request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = cache_control
+        resp.vary.add('Accept')
+        return resp
+
+    # 2a) Store de archivos: send_file (Range/If-Range y X-Sendfile si está habilitado)
+    path = get_image_storage().path(etag) if etag else None
+    if path:
+        resp = send_file(path, mimetype=mime_type or 'application/octet-stream',
+                         etag=etag, conditional=True)
+        resp.headers['Cache-Control'] = cache_control
+        resp.vary.add('Accept')
+        return resp
+
+    # 2b) Imágenes que siguen en la BD: recién acá traemos los bytes
+    data = db.session.query(model.bytes).filter(model.id == row_id).scalar()
+    if data is None and etag:
+        # referencia deduplicada: el blob lo tiene otra fila con el mismo digest
+        data = (
+            db.session.query(model.bytes)
+            .filter(model.digest == etag, model.bytes.isnot(None))
+            .limit(1)
+            .scalar()
+        )
+    if not data:
+        abort(404)
+
+    if not etag:
+        # imágenes viejas sin digest: lo calculamos una sola vez y lo guardamos
+        etag = hashlib.sha256(data).hexdigest()
+        try:
+            model.query.filter_by(id=row_id).update({'digest': etag})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+
+    # Respuesta binaria con cabeceras de caché agresivas (+ soporte de Range / If-Range)
+    resp = current_app.response_class(data, mimetype=mime_type or 'application/octet-stream')
+    resp.headers['Cache-Control'] = cache_control
+    # la misma URL puede devolver WEBP o JPEG según Accept
+    resp.vary.add('Accept')
+    resp.set_etag(etag)
+    return resp.make_conditional(request, accept_ranges=True, complete_length=len(data))
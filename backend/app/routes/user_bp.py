@@ -1,9 +1,14 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from flask_mail import Message
-from app import db, bcrypt, mail
+from app import db, bcrypt, catalog_cache
+from app.email_outbox import queue_email
 from app.models import User, Product, CartItem, Order, OrderItem
-from datetime import timedelta
+from app.stock import lock_stock, take_stock, take_flavor_stock
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload, joinedload
+from datetime import timedelta, datetime
+import base64
+import json
 import secrets
 import os
 
@@ -115,10 +120,9 @@ def show_users():
 def get_cart():
     """Obtener carrito del usuario"""
     try:
-        current_user_id = get_jwt_identity()
-        cart_items = CartItem.query.filter_by(user_id=current_user_id).all()
-        
-        return jsonify([item.serialize() for item in cart_items]), 200
+        current_user_id = int(get_jwt_identity())  # ← Convertir a int
+        # representación compacta en una sola query (ver CartItem.serialize_cart)
+        return jsonify(CartItem.serialize_cart(current_user_id)), 200
         
     except Exception as e:
         return jsonify({'error': 'Error al obtener carrito: ' + str(e)}), 500
@@ -243,15 +247,70 @@ def clear_cart():
 
 # === RUTAS PARA ÓRDENES ===
 
+ORDERS_PAGE_MAX = 50
+
+
+def _with_items(query):
+    # ítems + nombre del producto en 2 queries IN (...) en vez de 1 por orden y 1 por ítem
+    return query.options(
+        selectinload(Order.order_items)
+        .selectinload(OrderItem.product)
+        .load_only(Product.id, Product.name)
+    )
+
+
+def _encode_order_cursor(order):
+    raw = json.dumps([order.created_at.isoformat(), order.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def _decode_order_cursor(cursor):
+    try:
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(order_id)
+    except Exception:
+        raise ValueError('cursor inválido')
+
+
 @user_bp.route('/orders', methods=['GET'])
 @jwt_required()
 def get_orders():
+    """
+    Historial de órdenes del usuario (más nuevas primero).
+    Sin `limit`/`cursor` responde la lista completa (compat con el front actual);
+    con `limit` (máx. ORDERS_PAGE_MAX) y/o `cursor` responde {items, next_cursor}.
+    """
     try:
         current_user_id = int(get_jwt_identity())  # ← Convertir a int
-        orders = Order.query.filter_by(user_id=current_user_id).order_by(Order.created_at.desc()).all()
-        
-        return jsonify([order.serialize() for order in orders]), 200
-        
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+
+        # usa ix_order_user_created (user_id, created_at)
+        query = _with_items(
+            Order.query.filter_by(user_id=current_user_id)
+            .order_by(Order.created_at.desc(), Order.id.desc())
+        )
+
+        if limit is None and cursor is None:
+            return jsonify([order.serialize() for order in query.all()]), 200
+
+        if cursor:
+            after_created, after_id = _decode_order_cursor(cursor)
+            query = query.filter(tuple_(Order.created_at, Order.id) < tuple_(after_created, after_id))
+
+        limit = max(1, min(limit or ORDERS_PAGE_MAX, ORDERS_PAGE_MAX))
+        # uno más para saber si hay página siguiente
+        orders = query.limit(limit + 1).all()
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+
+        return jsonify({
+            'items': [order.serialize() for order in orders],
+            'next_cursor': _encode_order_cursor(orders[-1]) if has_more else None,
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Error al obtener órdenes: ' + str(e)}), 500
 
@@ -267,32 +326,58 @@ def create_order():
         if not shipping_address or not payment_method:
             return jsonify({'error': 'Dirección de envío y método de pago son requeridos'}), 400
         
-        # Obtener items del carrito
-        cart_items = CartItem.query.filter_by(user_id=current_user_id).all()
+        # Obtener items del carrito (con su producto en la misma query)
+        cart_items = (
+            CartItem.query.filter_by(user_id=current_user_id)
+            .options(joinedload(CartItem.product))
+            .all()
+        )
         
         if not cart_items:
             return jsonify({'error': 'El carrito está vacío'}), 400
         
-        # Verificar stock y calcular total
+        # Verificar productos y calcular total (el stock se valida al descontarlo)
         total_amount = 0
         order_items_data = []
+        quantities = {}
+        flavor_quantities = {}
         
         for cart_item in cart_items:
             product = cart_item.product
             if not product.is_active:
                 return jsonify({'error': f'El producto {product.name} no está disponible'}), 400
-            if product.stock < cart_item.quantity:
-                return jsonify({'error': f'Stock insuficiente para {product.name}'}), 400
             
             subtotal = product.price * cart_item.quantity
             total_amount += subtotal
+            quantities[product.id] = quantities.get(product.id, 0) + cart_item.quantity
+            if cart_item.selected_flavor and product.flavor_stock_mode:
+                key = (product.id, cart_item.selected_flavor)
+                flavor_quantities[key] = flavor_quantities.get(key, 0) + cart_item.quantity
             
             order_items_data.append({
                 'product_id': product.id,
                 'quantity': cart_item.quantity,
-                'price': product.price
+                'price': product.price,
+                'selected_flavor': cart_item.selected_flavor,
             })
         
+        # Descontar stock por sabor y total, cada uno en un solo UPDATE con guarda (todo o nada)
+        lock_stock(quantities, flavor_quantities)  # orden fijo de bloqueo: sin deadlocks entre carritos
+        missing_flavors = take_flavor_stock(flavor_quantities)
+        missing = take_stock(quantities) if not missing_flavors else []
+        if missing_flavors or missing:
+            db.session.rollback()
+            short = {pid for pid, _ in missing_flavors} | set(missing)
+            names = [ci.product.name for ci in cart_items if ci.product_id in missing] + [
+                f'{ci.product.name} ({ci.selected_flavor})'
+                for ci in cart_items
+                if (ci.product_id, ci.selected_flavor) in missing_flavors
+            ]
+            return jsonify({
+                'error': 'Stock insuficiente para ' + ', '.join(dict.fromkeys(names)),
+                'product_ids': sorted(short),
+            }), 409
+        
         # Crear la orden
         order = Order(
             user_id=current_user_id,
@@ -304,24 +389,22 @@ def create_order():
         db.session.add(order)
         db.session.flush()  # Para obtener el ID de la orden
         
-        # Crear los items de la orden y actualizar stock
+        # Crear los items de la orden
         for item_data in order_items_data:
             order_item = OrderItem(
                 order_id=order.id,
                 product_id=item_data['product_id'],
                 quantity=item_data['quantity'],
-                price=item_data['price']
+                price=item_data['price'],
+                selected_flavor=item_data['selected_flavor'],
             )
             db.session.add(order_item)
-            
-            # Actualizar stock
-            product = Product.query.get(item_data['product_id'])
-            product.stock -= item_data['quantity']
         
         # Vaciar carrito
         CartItem.query.filter_by(user_id=current_user_id).delete()
         
         db.session.commit()
+        catalog_cache.invalidate()  # cambió el stock
         
         return jsonify({
             'message': 'Orden creada exitosamente',
@@ -338,7 +421,7 @@ def get_order_by_id(order_id):
     """Obtener una orden específica"""
     try:
         current_user_id = get_jwt_identity()
-        order = Order.query.filter_by(id=order_id, user_id=current_user_id).first()
+        order = _with_items(Order.query.filter_by(id=order_id, user_id=current_user_id)).first()
         
         if not order:
             return jsonify({'error': 'Orden no encontrada'}), 404
@@ -470,20 +553,12 @@ def register_email():
         # Guardar token en algún lugar (podrías crear una tabla tokens o usar Redis)
         # Por simplicidad, vamos a usar el campo name temporalmente
         temp_user.name = f'temp_token:{token}'
-        db.session.commit()
-        
-        # Enviar email
-        msg = Message(
-            'Confirma tu registro en Zarpados Vapers',
-            recipients=[email],
-            charset='utf-8'
-        )
         
         # Crear URL del frontend para setup password
         frontend_url = "http://localhost:5174"  # URL del frontend
         setup_url = f"{frontend_url}/setup-password?token={token}"
         
-        msg.html = """
+        html = """
         <h2>¡Bienvenido a Zarpados Vapers!</h2>
         <p>Hace clic en el siguiente enlace para establecer tu contraseña:</p>
         <a href="{}" style="background: #7c3aed; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">
@@ -492,7 +567,9 @@ def register_email():
         <p>Si no solicitaste este registro, ignora este email.</p>
         """.format(setup_url)
         
-        mail.send(msg)
+        # El email sale en segundo plano (app/email_outbox.py), junto con el token
+        queue_email(email, 'Confirma tu registro en Zarpados Vapers', html, commit=False)
+        db.session.commit()
         
         return jsonify({
             'message': 'Email enviado correctamente',
@@ -553,20 +630,12 @@ def forgot_password():
         
         # Guardar token en el campo address temporalmente 
         user.address = f'reset_token:{reset_token}'
-        db.session.commit()
-        
-        # Enviar email de recuperación
-        msg = Message(
-            'Recupera tu contraseña - Zarpados Vapers',
-            recipients=[email],
-            charset='utf-8'
-        )
         
         # Crear URL del frontend para reset password
         frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")  # URL del frontend
         reset_url = f"{frontend_url}/reset-password/{reset_token}"
         
-        msg.html = """
+        html = """
         <h2>Recuperación de Contraseña</h2>
         <p>Recibimos una solicitud para restablecer tu contraseña en Zarpados Vapers.</p>
         <p>Hace clic en el siguiente enlace para crear una nueva contraseña:</p>
@@ -577,7 +646,9 @@ def forgot_password():
         <p>Este enlace expirará en 24 horas.</p>
         """.format(reset_url)
         
-        mail.send(msg)
+        # El email sale en segundo plano (app/email_outbox.py), junto con el token
+        queue_email(email, 'Recupera tu contraseña - Zarpados Vapers', html, commit=False)
+        db.session.commit()
         
         return jsonify({
             'message': 'Si el email existe, recibirás un enlace de recuperación'
@@ -0,0 +1,64 @@
+"""
+Búsqueda de productos.
+
+En Postgres usa la columna generada Product.search_vector (tsvector con la
+configuración 'es_unaccent' = spanish + unaccent, índice GIN), así "limon"
+encuentra "Limón" y la búsqueda no recorre toda la tabla. Cada palabra se
+busca como prefijo ("vap" -> "vape", "vaper").
+En otros motores (sqlite en tests) cae a ILIKE sobre las mismas columnas.
+"""
+import re
+
+from sqlalchemy import String, cast, func, or_, and_
+
+from app import db
+from app.models import Product
+
+SEARCH_CONFIG = 'es_unaccent'
+
+
+def _terms(text):
+    return re.findall(r'\w+', text or '', flags=re.UNICODE)
+
+
+def _like_pattern(term):
+    # \w incluye '_', comodín de LIKE: se escapan \, % y _ (con escape='\\' en search_filter)
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _is_postgres():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def _tsquery(terms):
+    # cada palabra como prefijo, todas obligatorias: "frutilla ice" -> "frutilla:* & ice:*"
+    return func.to_tsquery(SEARCH_CONFIG, ' & '.join(f"{t}:*" for t in terms))
+
+
+def search_filter(text):
+    """Criterio SQLAlchemy para filtrar productos por texto (None si no hay palabras)."""
+    terms = _terms(text)
+    if not terms:
+        return None
+    if _is_postgres():
+        return Product.search_vector.op('@@')(_tsquery(terms))
+    patterns = [_like_pattern(t) for t in terms]
+    return and_(*[
+        or_(
+            Product.name.ilike(p, escape='\\'),
+            Product.brand.ilike(p, escape='\\'),
+            Product.short_description.ilike(p, escape='\\'),
+            # el tsvector también indexa los sabores: mismo resultado que el camino FTS
+            cast(Product.flavors, String).ilike(p, escape='\\'),
+        )
+        for p in patterns
+    ])
+
+
+def search_rank(text):
+    """Expresión de relevancia para ORDER BY (None fuera de Postgres o sin palabras)."""
+    terms = _terms(text)
+    if not terms or not _is_postgres():
+        return None
+    return func.ts_rank_cd(Product.search_vector, _tsquery(terms))
@@ -0,0 +1,144 @@
+"""
+Descuento de stock atómico.
+
+Un solo UPDATE ... FROM (VALUES ...) con guarda `stock >= cantidad` para todas las
+líneas: la fila queda bloqueada por el UPDATE y una compra concurrente que llega
+después vuelve a evaluar la guarda con el stock ya descontado (READ COMMITTED),
+así nunca queda stock negativo ni se vende de más.
+
+El stock por sabor (ProductFlavor) se descuenta igual, en un solo UPDATE por lote
+con la fila de cada sabor como unidad de bloqueo: compras concurrentes de sabores
+distintos del mismo producto no se pisan. Con flavor_stock_mode, Product.stock es
+la suma de los sabores activos y se descuenta en la misma transacción
+(take_stock), así el total se mantiene sin recalcular.
+
+Orden de bloqueo: el UPDATE ... FROM bloquea en el orden que elija el plan, y dos
+carritos {A, B} / {B, A} podrían trabarse (deadlock). Antes de descontar o
+devolver, las filas se bloquean con SELECT ... ORDER BY ... FOR UPDATE: primero
+productos por id, después sabores por (product_id, nombre). Quien toque las dos
+tablas llama a lock_stock con todo antes de take_flavor_stock / take_stock.
+"""
+from sqlalchemy import Integer, String, column, func, select, tuple_, update, values
+
+from app import db
+from app.models import Product, ProductFlavor
+
+
+def _lock_products(product_ids):
+    if product_ids:
+        db.session.execute(
+            select(Product.id).where(Product.id.in_(sorted(product_ids))).order_by(Product.id).with_for_update()
+        ).all()
+
+
+def _lock_flavors(keys):
+    if keys:
+        db.session.execute(
+            select(ProductFlavor.id)
+            .where(tuple_(ProductFlavor.product_id, ProductFlavor.name).in_(sorted(keys)))
+            .order_by(ProductFlavor.product_id, ProductFlavor.name)
+            .with_for_update()
+        ).all()
+
+
+def lock_stock(product_ids=(), flavor_keys=()):
+    """
+    Bloquea (hasta el fin de la transacción) las filas de stock en orden fijo:
+    productos por id y después sabores por (product_id, nombre).
+    """
+    _lock_products({int(pid) for pid in product_ids})
+    _lock_flavors({(int(pid), name) for pid, name in flavor_keys})
+
+
+def take_stock(quantities):
+    """
+    quantities: {product_id: cantidad}.
+    Descuenta todo o nada: devuelve la lista de product_id sin stock suficiente
+    (vacía si se descontó). Ante faltantes el llamador debe hacer rollback.
+    """
+    quantities = {int(pid): int(q) for pid, q in quantities.items() if int(q) > 0}
+    if not quantities:
+        return []
+    _lock_products(quantities)
+
+    requested = values(
+        column('product_id', Integer), column('quantity', Integer), name='requested'
+    ).data(list(quantities.items()))
+
+    stmt = (
+        update(Product)
+        .where(Product.id == requested.c.product_id, Product.stock >= requested.c.quantity)
+        .values(stock=Product.stock - requested.c.quantity)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    updated = {pid for (pid,) in db.session.execute(stmt)}
+    return sorted(set(quantities) - updated)
+
+
+def take_flavor_stock(quantities):
+    """
+    quantities: {(product_id, sabor): cantidad}. Mismo contrato que take_stock:
+    devuelve las claves sin stock suficiente (o sabor inactivo / inexistente).
+    """
+    quantities = {(int(pid), name): int(q) for (pid, name), q in quantities.items() if int(q) > 0}
+    if not quantities:
+        return []
+    _lock_flavors(quantities)
+
+    requested = values(
+        column('product_id', Integer), column('name', String), column('quantity', Integer),
+        name='requested',
+    ).data([(pid, name, q) for (pid, name), q in quantities.items()])
+
+    stmt = (
+        update(ProductFlavor)
+        .where(
+            ProductFlavor.product_id == requested.c.product_id,
+            ProductFlavor.name == requested.c.name,
+            ProductFlavor.active == True,
+            ProductFlavor.stock >= requested.c.quantity,
+        )
+        .values(stock=ProductFlavor.stock - requested.c.quantity)
+        .returning(ProductFlavor.product_id, ProductFlavor.name)
+        .execution_options(synchronize_session=False)
+    )
+    updated = {(pid, name) for pid, name in db.session.execute(stmt)}
+    return sorted(set(quantities) - updated)
+
+
+def flavor_stock_total(product_id):
+    """Suma del stock de los sabores activos (lo que vale Product.stock con flavor_stock_mode)."""
+    return db.session.scalar(
+        select(func.coalesce(func.sum(ProductFlavor.stock), 0))
+        .where(ProductFlavor.product_id == product_id, ProductFlavor.active == True)
+    )
+
+
+def return_stock(quantities, flavor_quantities=None):
+    """Devuelve stock (reservas vencidas / liberadas). Mismas claves que take_stock / take_flavor_stock."""
+    quantities = {int(pid): int(q) for pid, q in (quantities or {}).items() if int(q) > 0}
+    flavor_quantities = {(int(pid), name): int(q) for (pid, name), q in (flavor_quantities or {}).items() if int(q) > 0}
+    lock_stock(quantities, flavor_quantities)
+    if quantities:
+        returned = values(
+            column('product_id', Integer), column('quantity', Integer), name='returned'
+        ).data(list(quantities.items()))
+        db.session.execute(
+            update(Product)
+            .where(Product.id == returned.c.product_id)
+            .values(stock=Product.stock + returned.c.quantity)
+            .execution_options(synchronize_session=False)
+        )
+
+    if flavor_quantities:
+        returned = values(
+            column('product_id', Integer), column('name', String), column('quantity', Integer),
+            name='returned',
+        ).data([(pid, name, q) for (pid, name), q in flavor_quantities.items()])
+        db.session.execute(
+            update(ProductFlavor)
+            .where(ProductFlavor.product_id == returned.c.product_id, ProductFlavor.name == returned.c.name)
+            .values(stock=ProductFlavor.stock + returned.c.quantity)
+            .execution_options(synchronize_session=False)
+        )
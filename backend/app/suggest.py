@@ -0,0 +1,95 @@
+"""
+Índice en memoria para el autocompletado (/public/suggest).
+
+Se arma con una sola query (nombres, marcas y sabores de productos activos) y se
+guarda como lista ordenada de claves normalizadas (minúsculas, sin acentos):
+buscar un prefijo es un bisect, sin ir a la BD. Se indexa el texto completo y
+cada palabra, así "ice" sugiere "Frutilla Ice".
+
+Se reconstruye solo cuando cambia catalog_cache.version (escrituras del admin,
+cambios de stock), de modo que todos los workers se actualizan solos.
+"""
+import bisect
+import threading
+import unicodedata
+
+KIND_WEIGHT = {'product': 0, 'brand': 1, 'flavor': 2}
+# tope de claves a revisar por consulta (prefijos de 1 letra en catálogos grandes)
+MAX_SCAN = 500
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+class SuggestIndex:
+    def __init__(self):
+        # (claves normalizadas ordenadas, [(kind, text, product_id, normalizado)] alineado)
+        self._index = ([], [])
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        from app import db
+        from app.models import Product
+
+        items = {}  # (kind, texto normalizado) -> (kind, text, product_id, texto normalizado)
+        rows = (
+            db.session.query(Product.id, Product.name, Product.brand, Product.flavors)
+            .filter(Product.is_active == True)
+            .all()
+        )
+        for pid, name, brand, flavors in rows:
+            if name:
+                items.setdefault(('product', normalize(name)), ('product', name, pid, normalize(name)))
+            if brand:
+                items.setdefault(('brand', normalize(brand)), ('brand', brand, None, normalize(brand)))
+            for flavor in flavors or []:
+                if isinstance(flavor, str) and flavor.strip():
+                    items.setdefault(('flavor', normalize(flavor)), ('flavor', flavor.strip(), None, normalize(flavor)))
+
+        pairs = []
+        for (_, norm), entry in items.items():
+            words = norm.split()
+            # texto completo + cada palabra desde su posición ("frutilla ice" -> "ice")
+            starts = {norm} | {' '.join(words[i:]) for i in range(1, len(words))}
+            pairs.extend((key, entry) for key in starts)
+        pairs.sort(key=lambda p: p[0])
+        return [k for k, _ in pairs], [e for _, e in pairs]
+
+    def refresh(self, version):
+        if self._version == version:
+            return
+        with self._lock:
+            if self._version == version:
+                return
+            keys, entries = self._build()
+            self._index = (keys, entries)  # reemplazo atómico: las consultas en curso siguen con el viejo
+            self._version = version
+
+    def suggest(self, prefix, limit=8):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        keys, entries = self._index
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + '\uffff')
+
+        seen, found = set(), []
+        for i in range(start, min(end, start + MAX_SCAN)):
+            kind, text, pid, norm = entries[i]
+            if (kind, text) in seen:
+                continue
+            seen.add((kind, text))
+            # coincidencia al inicio del texto primero, después por tipo y largo
+            exact_start = norm.startswith(prefix)
+            found.append(((not exact_start, KIND_WEIGHT[kind], len(text)), kind, text, pid))
+        found.sort(key=lambda f: f[0])
+        return [
+            {'text': text, 'type': kind, 'product_id': pid}
+            for _, kind, text, pid in found[:limit]
+        ]
+
+
+suggest_index = SuggestIndex()
@@ -0,0 +1,194 @@
+"""
+Bandeja de entrada de webhooks de MercadoPago.
+
+El endpoint /webhook solo guarda la notificación (enqueue_payment) y responde 200
+en milisegundos; la consulta a la API de MP, la creación de la orden y el email
+corren acá, en un pool de hilos por worker de gunicorn (greenlets con gevent).
+
+- Idempotente por payment_id: una fila por pago; las notificaciones repetidas
+  mientras está pendiente no agregan trabajo. Si llega otra cuando ya se procesó
+  (p. ej. el pago pasó de pending a approved) se vuelve a encolar; si llega
+  mientras se está procesando, se marca requeue y al terminar vuelve a 'pending'
+  (el worker pudo haber consultado el pago antes de la aprobación).
+- Cada fila se toma con FOR UPDATE SKIP LOCKED y queda 'processing' con un lease
+  (next_attempt_at): si el proceso muere, otro worker la retoma al vencer.
+- Errores: reintento con backoff exponencial hasta WEBHOOK_MAX_ATTEMPTS -> 'failed'.
+"""
+import threading
+import traceback
+from datetime import timedelta
+
+LEASE_SECONDS = 300
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 3600
+
+
+def enqueue_payment(payment_id, topic='payment'):
+    """Guarda la notificación (una fila por payment_id) y despierta a los workers."""
+    from sqlalchemy import case
+    from sqlalchemy.dialects.postgresql import insert
+    from app import db, webhook_worker
+    from app.models import WebhookInbox, now_cba_naive
+
+    now = now_cba_naive()
+    stmt = insert(WebhookInbox).values(
+        payment_id=str(payment_id), topic=topic, status='pending',
+        attempts=0, next_attempt_at=now, created_at=now,
+    )
+    # en proceso: no se toca el lease, solo se pide otra pasada (ver _finish)
+    processing = WebhookInbox.status == 'processing'
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[WebhookInbox.payment_id],
+        set_={
+            'status': case((processing, 'processing'), else_='pending'),
+            'requeue': processing,
+            'attempts': case((processing, WebhookInbox.attempts), else_=0),
+            'next_attempt_at': case((processing, WebhookInbox.next_attempt_at), else_=now),
+            'last_error': case((processing, WebhookInbox.last_error), else_=None),
+        },
+        # si todavía está pendiente, no hay nada que hacer
+        where=WebhookInbox.status != 'pending',
+    )
+    db.session.execute(stmt)
+    db.session.commit()
+    webhook_worker.notify()
+
+
+def _backoff(attempts):
+    return min(BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SECONDS)
+
+
+def _claim():
+    """Toma una notificación lista (o con lease vencido). -> (id, payment_id, attempts) | None"""
+    from sqlalchemy import select, update
+    from app import db
+    from app.models import WebhookInbox, now_cba_naive
+
+    now = now_cba_naive()
+    due = (
+        select(WebhookInbox.id)
+        .where(WebhookInbox.status.in_(('pending', 'processing')), WebhookInbox.next_attempt_at <= now)
+        .order_by(WebhookInbox.next_attempt_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    row = db.session.execute(
+        update(WebhookInbox)
+        .where(WebhookInbox.id.in_(due))
+        .values(
+            status='processing',
+            requeue=False,
+            attempts=WebhookInbox.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=LEASE_SECONDS),
+        )
+        .returning(WebhookInbox.id, WebhookInbox.payment_id, WebhookInbox.attempts)
+        .execution_options(synchronize_session=False)
+    ).first()
+    db.session.commit()
+    return row
+
+
+def _finish(inbox_id, error=None, attempts=0, max_attempts=1):
+    """Cierra el intento; si llegó otra notificación mientras tanto (requeue) vuelve a 'pending' ya."""
+    from sqlalchemy import case, update
+    from app import db
+    from app.models import WebhookInbox, now_cba_naive
+
+    now = now_cba_naive()
+    if error is None:
+        values = {'status': 'done', 'processed_at': now, 'last_error': None}
+    elif attempts >= max_attempts:
+        values = {'status': 'failed', 'processed_at': now, 'last_error': error}
+    else:
+        values = {
+            'status': 'pending',
+            'next_attempt_at': now + timedelta(seconds=_backoff(attempts)),
+            'last_error': error,
+        }
+    # llegó otra notificación mientras se procesaba: otra pasada enseguida
+    requeue = WebhookInbox.requeue
+    values['status'] = case((requeue, 'pending'), else_=values['status'])
+    values['attempts'] = case((requeue, 0), else_=WebhookInbox.attempts)
+    values['next_attempt_at'] = case((requeue, now), else_=values.get('next_attempt_at', WebhookInbox.next_attempt_at))
+    values['requeue'] = False
+    db.session.execute(
+        update(WebhookInbox).where(WebhookInbox.id == inbox_id).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+class WebhookWorker:
+    """Pool de hilos que vacía la bandeja (WEBHOOK_WORKERS por proceso)."""
+
+    def __init__(self):
+        self.app = None
+        self.workers = 2
+        self.poll_seconds = 5
+        self.max_attempts = 8
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('WEBHOOK_WORKERS', self.workers)
+        self.poll_seconds = app.config.get('WEBHOOK_POLL_SECONDS', self.poll_seconds)
+        self.max_attempts = app.config.get('WEBHOOK_MAX_ATTEMPTS', self.max_attempts)
+        app.extensions['webhook_worker'] = self
+        if self.workers:
+            # arranca con el primer request: no corre en `flask db upgrade` ni en scripts
+            app.before_request(self.start)
+
+    def start(self):
+        if self._threads:
+            return
+        with self._lock:
+            if not self._threads:
+                self._threads = [
+                    threading.Thread(target=self._run, name=f'webhook-worker-{n}', daemon=True)
+                    for n in range(self.workers)
+                ]
+                for t in self._threads:
+                    t.start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def drain(self):
+        """Procesa todo lo que esté listo. -> cantidad procesada (también sirve para tests / scripts)."""
+        processed = 0
+        while self.process_one():
+            processed += 1
+        return processed
+
+    def process_one(self):
+        from app import db
+        from app.routes.mercadopago_bp import process_payment_notification
+
+        claimed = _claim()
+        if not claimed:
+            return False
+        inbox_id, payment_id, attempts = claimed
+        try:
+            process_payment_notification(payment_id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Webhook payment_id={payment_id} intento {attempts}: {e}\n{traceback.format_exc()}")
+            _finish(inbox_id, error=str(e)[:2000], attempts=attempts, max_attempts=self.max_attempts)
+        else:
+            _finish(inbox_id)
+        return True
+
+    def _run(self):
+        from app import db
+        while True:
+            with self.app.app_context():
+                try:
+                    self.drain()
+                except Exception:
+                    db.session.rollback()
+                    print(f"❌ Error en el worker de webhooks:\n{traceback.format_exc()}")
+            # espera la próxima notificación (o el poll para reintentos / otros workers)
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
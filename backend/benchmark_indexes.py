@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los índices de acceso de la tienda (listado de productos, carrito,
+historial de pedidos). Carga un dataset sintético, corre EXPLAIN ANALYZE de las
+queries reales SIN y CON los índices, y al final hace ROLLBACK: la BD queda igual.
+
+Usar contra una BD de desarrollo (toma locks sobre product, cart_item, order, order_item).
+
+Ejecutar desde la carpeta backend:
+  python benchmark_indexes.py            # escala 1: 20k productos, 50k pedidos, 150k ítems
+  python benchmark_indexes.py --scale 5
+  python benchmark_indexes.py --full     # plan completo (por defecto solo los nodos Seq/Index Scan)
+"""
+
+import sys
+import os
+import re
+
+# Agregar el directorio del proyecto al path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+
+from app.run import app
+from app import db
+from app.models import Product, CartItem, Order, OrderItem
+
+# Índices bajo prueba (declarados en app/models.py, migración f3a9d7c60e15)
+BENCH_INDEXES = {
+    Product: ('ix_product_active_category', 'ix_product_active_created'),
+    CartItem: ('ix_cart_item_user_product',),
+    Order: ('ix_order_user_created',),
+    OrderItem: ('ix_order_item_order_id',),
+}
+
+SEED_SQL = [
+    """
+    INSERT INTO category (name, description)
+    SELECT 'bench-' || g, 'benchmark' FROM generate_series(1, 20) g
+    """,
+    """
+    INSERT INTO product (name, price, stock, category_id, is_active, flavor_stock_mode, created_at)
+    SELECT 'Bench vape ' || g,
+           (random() * 50000)::numeric(10, 2),
+           (random() * 100)::int,
+           (SELECT id FROM category WHERE name = 'bench-' || (1 + g % 20)),
+           random() < 0.9,
+           false,
+           now() - random() * interval '720 days'
+    FROM generate_series(1, :products) g
+    """,
+    """
+    INSERT INTO "user" (email, password, name, role, last_login, is_active, is_premium, is_admin)
+    SELECT 'bench-' || g || '@example.invalid', 'x', 'Bench ' || g, 'user', now(), true, false, false
+    FROM generate_series(1, :users) g
+    """,
+    """
+    INSERT INTO "order" (user_id, total_amount, status, shipping_address, payment_method,
+                         customer_email, customer_name, created_at, updated_at)
+    SELECT u.id, 10000, 'paid', 'Calle 123', 'mercadopago', u.email, u.name, t.ts, t.ts
+    FROM generate_series(1, :orders) g
+    JOIN "user" u ON u.email = 'bench-' || (1 + g % :users) || '@example.invalid'
+    CROSS JOIN LATERAL (SELECT now() - random() * interval '720 days' AS ts) t
+    """,
+    """
+    INSERT INTO order_item (order_id, product_id, quantity, price)
+    SELECT x.order_id, p.id, 1, p.price
+    FROM (
+        SELECT o.id AS order_id, b.lo + floor(random() * :products)::int AS product_id
+        FROM "order" o
+        CROSS JOIN generate_series(1, 3) n
+        CROSS JOIN (SELECT min(id) AS lo FROM product WHERE name LIKE 'Bench vape %') b
+        WHERE o.customer_email LIKE 'bench-%'
+    ) x
+    JOIN product p ON p.id = x.product_id
+    """,
+    """
+    INSERT INTO cart_item (user_id, product_id, quantity, created_at)
+    SELECT u.id, b.lo + (g % :products), 1, now()
+    FROM generate_series(1, :cart_items) g
+    JOIN "user" u ON u.email = 'bench-' || (1 + g % :users) || '@example.invalid'
+    CROSS JOIN (SELECT min(id) AS lo FROM product WHERE name LIKE 'Bench vape %') b
+    """,
+]
+
+# Mismas formas que las queries de public_bp / user_bp
+QUERIES = {
+    'productos por categoría (newest)': """
+        SELECT id, name, price FROM product
+        WHERE is_active AND category_id = (SELECT id FROM category WHERE name = 'bench-7')
+        ORDER BY created_at DESC, id DESC LIMIT 24
+    """,
+    'productos activos (newest)': """
+        SELECT id, name, price FROM product
+        WHERE is_active ORDER BY created_at DESC, id DESC LIMIT 24
+    """,
+    'carrito del usuario': """
+        SELECT * FROM cart_item
+        WHERE user_id = (SELECT id FROM "user" WHERE email = 'bench-42@example.invalid')
+    """,
+    'historial de pedidos': """
+        SELECT * FROM "order"
+        WHERE user_id = (SELECT id FROM "user" WHERE email = 'bench-42@example.invalid')
+        ORDER BY created_at DESC
+    """,
+    'ítems de los pedidos': """
+        SELECT * FROM order_item WHERE order_id IN (
+            SELECT id FROM "order"
+            WHERE user_id = (SELECT id FROM "user" WHERE email = 'bench-42@example.invalid')
+        )
+    """,
+}
+
+
+def _indexes():
+    for model, names in BENCH_INDEXES.items():
+        for index in model.__table__.indexes:
+            if index.name in names:
+                yield index
+
+
+def _explain(sql, full=False):
+    """-> (nodos del plan, ms). Sin full, solo los nodos de acceso (Seq Scan / Index Scan / ...)."""
+    rows = db.session.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + sql)).scalars().all()
+    timing = next((r for r in rows if r.startswith('Execution Time')), '')
+    ms = float(re.search(r'([\d.]+) ms', timing).group(1)) if timing else None
+    if full:
+        plan = [r for r in rows if not r.startswith(('Planning', 'Execution'))]
+    else:
+        # "->  Index Scan using ix_... on product  (cost=...)" -> "Index Scan using ix_... on product"
+        plan = [re.sub(r'^\s*(->\s*)?|\s*\(cost=.*$', '', r) for r in rows if 'Scan' in r]
+    return plan, ms
+
+
+def run_queries(full=False):
+    db.session.execute(text('ANALYZE product, cart_item, "order", order_item'))
+    return {name: _explain(sql, full) for name, sql in QUERIES.items()}
+
+
+if __name__ == "__main__":
+    scale = 1
+    full = '--full' in sys.argv  # plan completo en vez de solo los nodos Scan
+    if '--scale' in sys.argv:
+        scale = int(sys.argv[sys.argv.index('--scale') + 1])
+
+    params = {
+        'products': 20000 * scale,
+        'users': 2000 * scale,
+        'orders': 50000 * scale,
+        'cart_items': 20000 * scale,
+    }
+
+    with app.app_context():
+        try:
+            print(f"🌱 Cargando dataset sintético: {params}")
+            for sql in SEED_SQL:
+                db.session.execute(text(sql), params)
+
+            for index in _indexes():
+                db.session.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+            before = run_queries(full)
+
+            for index in _indexes():
+                db.session.execute(CreateIndex(index))
+            after = run_queries(full)
+
+            for name in QUERIES:
+                (plan_before, ms_before), (plan_after, ms_after) = before[name], after[name]
+                print(f"\n📊 {name}")
+                for label, plan, ms in (('sin índices', plan_before, ms_before), ('con índices', plan_after, ms_after)):
+                    print(f"   {label}: {ms:9.2f} ms")
+                    for node in plan:
+                        print(f"      {node}")
+        except Exception as e:
+            print(f"❌ Error en el benchmark: {e}")
+            sys.exit(1)
+        finally:
+            # DDL y datos sintéticos se descartan
+            db.session.rollback()
+            print("\n↩️  Rollback hecho, la BD quedó como estaba.")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Script para mover los bytes de las imágenes de Postgres al store de archivos
+(IMAGE_STORE_DIR, direccionado por digest). Procesa de a una imagen por vez para
+no cargar todos los blobs en memoria.
+
+Ejecutar desde la carpeta backend:
+  python migrate_images_to_store.py             # BD -> archivos (deja bytes en NULL)
+  python migrate_images_to_store.py --keep-db   # copia sin borrar de la BD
+  python migrate_images_to_store.py --to-db     # archivos -> BD (antes de un downgrade)
+"""
+
+import sys
+import os
+import hashlib
+
+# Agregar el directorio del proyecto al path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.run import app
+from app import db
+from app.models import ProductImage, ProductImageVariant
+from app.image_storage import LocalImageStorage
+
+BATCH_SIZE = 50
+
+
+def export_to_store(model, storage, keep_db=False):
+    """Escribe cada blob en el store y (salvo keep_db) lo borra de la BD."""
+    ids = [i for (i,) in db.session.query(model.id).filter(model.bytes.isnot(None)).order_by(model.id)]
+    moved = 0
+    for n, row_id in enumerate(ids, start=1):
+        data = db.session.query(model.bytes).filter(model.id == row_id).scalar()
+        digest = hashlib.sha256(data).hexdigest()
+        storage.save(digest, data)
+
+        values = {'digest': digest}
+        if not keep_db:
+            values['bytes'] = None
+        model.query.filter_by(id=row_id).update(values)
+        moved += 1
+
+        if n % BATCH_SIZE == 0:
+            db.session.commit()
+            print(f"   {model.__tablename__}: {n}/{len(ids)}")
+    db.session.commit()
+    return moved
+
+
+def import_to_db(model, storage):
+    """Vuelve a cargar en la BD los bytes de las filas que solo están en el store."""
+    rows = db.session.query(model.id, model.digest).filter(model.bytes.is_(None)).order_by(model.id).all()
+    restored = 0
+    for n, (row_id, digest) in enumerate(rows, start=1):
+        path = storage.path(digest) if digest else None
+        if not path:
+            print(f"⚠️  {model.__tablename__} #{row_id}: no se encontró el archivo {digest}")
+            continue
+        with open(path, 'rb') as f:
+            model.query.filter_by(id=row_id).update({'bytes': f.read()})
+        restored += 1
+        if n % BATCH_SIZE == 0:
+            db.session.commit()
+    db.session.commit()
+    return restored
+
+
+if __name__ == "__main__":
+    keep_db = '--keep-db' in sys.argv
+    to_db = '--to-db' in sys.argv
+
+    with app.app_context():
+        storage = LocalImageStorage(app.config['IMAGE_STORE_DIR'])
+        print(f"📁 Store de imágenes: {storage.root}")
+        try:
+            for model in (ProductImage, ProductImageVariant):
+                if to_db:
+                    count = import_to_db(model, storage)
+                    print(f"✅ {model.__tablename__}: {count} imágenes restauradas en la BD")
+                else:
+                    count = export_to_store(model, storage, keep_db=keep_db)
+                    print(f"✅ {model.__tablename__}: {count} imágenes movidas al store")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error migrando imágenes: {e}")
+            sys.exit(1)
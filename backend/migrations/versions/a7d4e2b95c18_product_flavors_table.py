@@ -0,0 +1,69 @@
+"""product_flavors table replaces product.flavor_catalog JSONB
+
+Revision ID: a7d4e2b95c18
+Revises: f3a9d7c60e15
+Create Date: 2026-10-18 14:22:07.916342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d4e2b95c18'
+down_revision = 'f3a9d7c60e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_flavors',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.Column('stock', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('product_id', 'name', name='uq_product_flavors_product_name')
+    )
+
+    # Copiar el catálogo JSONB (mismas reglas que _normalize_catalog del admin:
+    # strings sueltos = sabor activo sin stock, stock inválido = 0, nombres repetidos = el primero)
+    op.execute("""
+        INSERT INTO product_flavors (product_id, name, active, stock, position)
+        SELECT DISTINCT ON (product_id, name) product_id, name, active, stock, position
+        FROM (
+            SELECT p.id AS product_id,
+                   btrim(CASE jsonb_typeof(e) WHEN 'object' THEN e->>'name' ELSE e #>> '{}' END) AS name,
+                   CASE WHEN jsonb_typeof(e->'active') = 'boolean' THEN (e->>'active')::boolean ELSE true END AS active,
+                   CASE WHEN (e->>'stock') ~ '^\\d+$' THEN (e->>'stock')::int ELSE 0 END AS stock,
+                   (t.ord - 1)::int AS position
+            FROM product p
+            CROSS JOIN LATERAL jsonb_array_elements(
+                CASE jsonb_typeof(p.flavor_catalog) WHEN 'array' THEN p.flavor_catalog ELSE '[]'::jsonb END
+            ) WITH ORDINALITY AS t(e, ord)
+        ) src
+        WHERE coalesce(name, '') <> ''
+        ORDER BY product_id, name, position
+    """)
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_column('flavor_catalog')
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('flavor_catalog', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+    op.execute("""
+        UPDATE product p SET flavor_catalog = coalesce((
+            SELECT jsonb_agg(jsonb_build_object('name', f.name, 'active', f.active, 'stock', f.stock) ORDER BY f.position)
+            FROM product_flavors f
+            WHERE f.product_id = p.id
+        ), '[]'::jsonb)
+    """)
+
+    op.drop_table('product_flavors')
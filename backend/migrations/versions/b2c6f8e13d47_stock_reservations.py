@@ -0,0 +1,56 @@
+"""stock reservations (TTL holds during MercadoPago checkout)
+
+Revision ID: b2c6f8e13d47
+Revises: a7d4e2b95c18
+Create Date: 2026-10-18 15:03:26.184720
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2c6f8e13d47'
+down_revision = 'a7d4e2b95c18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_reservations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('reference', sa.String(length=64), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('flavor', sa.String(length=120), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_reservations', schema=None) as batch_op:
+        batch_op.create_index('ix_stock_reservations_reference', ['reference'], unique=False)
+        batch_op.create_index('ix_stock_reservations_held_expires', ['expires_at'], unique=False, postgresql_where=sa.text("status = 'held'"))
+
+
+def downgrade():
+    # devolver el stock que siga apartado antes de borrar las reservas
+    op.execute("""
+        UPDATE product p SET stock = p.stock + r.quantity
+        FROM (SELECT product_id, sum(quantity) AS quantity FROM stock_reservations
+              WHERE status = 'held' GROUP BY product_id) r
+        WHERE p.id = r.product_id
+    """)
+    op.execute("""
+        UPDATE product_flavors f SET stock = f.stock + r.quantity
+        FROM (SELECT product_id, flavor, sum(quantity) AS quantity FROM stock_reservations
+              WHERE status = 'held' AND flavor IS NOT NULL GROUP BY product_id, flavor) r
+        WHERE f.product_id = r.product_id AND f.name = r.flavor
+    """)
+
+    with op.batch_alter_table('stock_reservations', schema=None) as batch_op:
+        batch_op.drop_index('ix_stock_reservations_held_expires', postgresql_where=sa.text("status = 'held'"))
+        batch_op.drop_index('ix_stock_reservations_reference')
+
+    op.drop_table('stock_reservations')
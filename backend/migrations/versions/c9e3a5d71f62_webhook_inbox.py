@@ -0,0 +1,41 @@
+"""webhook inbox for MercadoPago notifications
+
+Revision ID: c9e3a5d71f62
+Revises: b2c6f8e13d47
+Create Date: 2026-10-18 15:41:55.307194
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e3a5d71f62'
+down_revision = 'b2c6f8e13d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_inbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('payment_id', sa.String(length=100), nullable=False),
+    sa.Column('topic', sa.String(length=50), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('payment_id')
+    )
+    with op.batch_alter_table('webhook_inbox', schema=None) as batch_op:
+        batch_op.create_index('ix_webhook_inbox_due', ['next_attempt_at'], unique=False, postgresql_where=sa.text("status IN ('pending', 'processing')"))
+
+
+def downgrade():
+    with op.batch_alter_table('webhook_inbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_inbox_due', postgresql_where=sa.text("status IN ('pending', 'processing')"))
+
+    op.drop_table('webhook_inbox')
@@ -0,0 +1,58 @@
+"""product full-text search (unaccent + spanish, GIN)
+
+Revision ID: d2b6f4a91e07
+Revises: c5a8e3b27d90
+Create Date: 2026-10-18 12:31:52.614830
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b6f4a91e07'
+down_revision = 'c5a8e3b27d90'
+branch_labels = None
+depends_on = None
+
+# Mismo texto que PRODUCT_SEARCH_VECTOR_SQL en app/models.py
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('es_unaccent'::regconfig, coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('es_unaccent'::regconfig, coalesce(brand, '')), 'A') || "
+    "setweight(jsonb_to_tsvector('es_unaccent'::regconfig, coalesce(flavors, '[]'::jsonb), '[\"string\"]'), 'B') || "
+    "setweight(to_tsvector('es_unaccent'::regconfig, coalesce(short_description, '')), 'C')"
+)
+
+
+def upgrade():
+    # Configuración de búsqueda en español que ignora acentos ("limon" == "limón")
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    op.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+                CREATE TEXT SEARCH CONFIGURATION es_unaccent (COPY = spanish);
+                ALTER TEXT SEARCH CONFIGURATION es_unaccent
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+            END IF;
+        END
+        $$;
+    """)
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column(
+            'search_vector',
+            postgresql.TSVECTOR(),
+            sa.Computed(SEARCH_VECTOR_SQL, persisted=True),
+            nullable=True,
+        ))
+        batch_op.create_index('ix_product_search_vector', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_search_vector', postgresql_using='gin')
+        batch_op.drop_column('search_vector')
+
+    op.execute("DROP TEXT SEARCH CONFIGURATION IF EXISTS es_unaccent")
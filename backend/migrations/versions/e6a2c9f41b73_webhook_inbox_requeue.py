@@ -0,0 +1,26 @@
+"""webhook inbox requeue flag for notifications received while processing
+
+Revision ID: e6a2c9f41b73
+Revises: d5f1b8c24a93
+Create Date: 2026-10-18 18:03:27.418552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a2c9f41b73'
+down_revision = 'd5f1b8c24a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('webhook_inbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('requeue', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('webhook_inbox', schema=None) as batch_op:
+        batch_op.drop_column('requeue')
@@ -0,0 +1,32 @@
+"""product facet indexes (brand, price, puffs, flavors GIN)
+
+Revision ID: e8c1f5a37b29
+Revises: d2b6f4a91e07
+Create Date: 2026-10-18 13:05:41.208317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c1f5a37b29'
+down_revision = 'd2b6f4a91e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index('ix_product_active_brand', ['brand', 'price'], unique=False, postgresql_where=sa.text('is_active'))
+        batch_op.create_index('ix_product_active_price', ['price', 'id'], unique=False, postgresql_where=sa.text('is_active'))
+        batch_op.create_index('ix_product_active_puffs', ['puffs'], unique=False, postgresql_where=sa.text('is_active'))
+        batch_op.create_index('ix_product_flavors', ['flavors'], unique=False, postgresql_using='gin', postgresql_ops={'flavors': 'jsonb_path_ops'})
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_flavors', postgresql_using='gin')
+        batch_op.drop_index('ix_product_active_puffs', postgresql_where=sa.text('is_active'))
+        batch_op.drop_index('ix_product_active_price', postgresql_where=sa.text('is_active'))
+        batch_op.drop_index('ix_product_active_brand', postgresql_where=sa.text('is_active'))
@@ -0,0 +1,46 @@
+"""storefront access-path indexes (product listing, cart, order history)
+
+Revision ID: f3a9d7c60e15
+Revises: e8c1f5a37b29
+Create Date: 2026-10-18 13:40:12.553901
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d7c60e15'
+down_revision = 'e8c1f5a37b29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index('ix_product_active_category', ['category_id', 'created_at', 'id'], unique=False, postgresql_where=sa.text('is_active'))
+        batch_op.create_index('ix_product_active_created', ['created_at', 'id'], unique=False, postgresql_where=sa.text('is_active'))
+
+    with op.batch_alter_table('cart_item', schema=None) as batch_op:
+        batch_op.create_index('ix_cart_item_user_product', ['user_id', 'product_id'], unique=False)
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.create_index('ix_order_user_created', ['user_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.create_index('ix_order_item_order_id', ['order_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_item_order_id')
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_user_created')
+
+    with op.batch_alter_table('cart_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_cart_item_user_product')
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_active_created', postgresql_where=sa.text('is_active'))
+        batch_op.drop_index('ix_product_active_category', postgresql_where=sa.text('is_active'))
@@ -0,0 +1,26 @@
+"""product_images queued_at para reencolar procesamientos perdidos
+
+Revision ID: f7b3d1e85c26
+Revises: e6a2c9f41b73
+Create Date: 2026-10-18 18:26:41.072915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b3d1e85c26'
+down_revision = 'e6a2c9f41b73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_images', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('queued_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('product_images', schema=None) as batch_op:
+        batch_op.drop_column('queued_at')
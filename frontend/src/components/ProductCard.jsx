@@ -32,6 +32,13 @@ const toAbsUrl = (u = "") => {
   return `${API}/${u}`;
 };
 
+// srcset para imágenes internas (/public/img/<id>): el backend elige la variante por ?w=
+const toSrcSet = (u = "") => {
+  const abs = toAbsUrl(u);
+  if (!/\/public\/img\/\d+$/.test(abs)) return undefined;
+  return [200, 400, 800].map((w) => `${abs}?w=${w} ${w}w`).join(", ");
+};
+
 
 
 
@@ -75,6 +82,8 @@ export default function ProductCard({ product }) {
       <div onClick={handleProductClick} className="w-full cursor-pointer">
         <img
           src={toAbsUrl(product?.image_url) || "/sin_imagen.jpg"}
+          srcSet={toSrcSet(product?.image_url)}
+          sizes="(min-width: 1024px) 25vw, 50vw"
           alt={product?.name || "Producto"}
           className="block w-full h-auto"
           loading="lazy"